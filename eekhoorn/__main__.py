@@ -6,77 +6,237 @@ import argparse
 import io
 import os
 import sys
+import time
 from contextlib import closing
 from functools import partial
-from itertools import islice
 
 import sqlalchemy.exc
 from colors import green, red
 from pyrepl.unix_console import UnixConsole
-from six import integer_types
+from six import text_type
 
-from eekhoorn.gateway import DatabaseGateway
+from eekhoorn.batch import run_batch
+from eekhoorn.gateway import DEFAULT_BATCH_SIZE, DatabaseGateway
+from eekhoorn.meta_commands import CommandError, MetaCommands, is_command
 from eekhoorn.reader import Reader
-from eekhoorn.pager import paginate
-from eekhoorn.table import DefaultCellRenderer, Table
+from eekhoorn.pager import ColumnScroller, paginate
+from eekhoorn.renderers import AutoRenderer, get_column_renderer
+from eekhoorn.result_store import RowStore
+from eekhoorn.schema_cache import SchemaCache
+from eekhoorn.sql import iter_statements
+from eekhoorn.table import Table
+from eekhoorn.timing import Timings
+from eekhoorn.writers import FORMATS, get_writer
 
 
 ENCODING = "utf-8"
-MAX_ROWS = 250
+#: Number of rows used to determine the width of the columns
+SAMPLE_ROWS = 5000
+#: Tables with more columns than fit the console with this width each
+#: show only the columns that fit instead of shrinking all of them
+MIN_COLUMN_WIDTH = 8
 HISTORY_PATH = "~/.eekhoornhistory"
 
 
-class CellRenderer(object):
-    def __init__(self):
-        self.renderer_left = DefaultCellRenderer("left")
-        self.renderer_right = DefaultCellRenderer("right")
-
-    def estimate_width(self, value):
-        return self.renderer_left.estimate_width(value)
-
-    def render(self, value, width):
-        color = None
-        renderer = self.renderer_left
-        if value is None:
-            value = "NULL"
-            color = partial(red, style="italic")
-            renderer = self.renderer_right
-        elif isinstance(value, integer_types + (float, )):
-            color = green
-            renderer = self.renderer_right
-        for line in renderer.render(value, width):
-            if color is not None:
-                line = color(line)
+class QueryProgress(object):
+    "Shows how long a running query takes and how many rows it fetched."
+
+    def __init__(self, query):
+        self.query = query
+        self._msg_length = 0
+
+    def update(self):
+        msg = "Running query\u2026 {0:.1f}s, {1:n} rows fetched".format(
+            self.query.elapsed, self.query.rows_fetched)
+        sys.stdout.write("\r" + green(msg.ljust(self._msg_length)))
+        sys.stdout.flush()
+        self._msg_length = max(self._msg_length, len(msg))
+
+    def clear(self):
+        if self._msg_length:
+            sys.stdout.write("\r" + " " * self._msg_length + "\r")
+            sys.stdout.flush()
+            self._msg_length = 0
+
+    def clear_before(self, lines):
+        "Clears the progress message before each line of `lines`."
+        for line in lines:
+            self.clear()
             yield line
 
-def tableify(result, max_width):
-    renderer = CellRenderer()
-    columns = zip(result.keys(), [renderer] * len(result.keys()))
-    table = Table(columns, max_width=max_width)
-    for row in islice(result, MAX_ROWS):
-        table.add_row(row)
-    return table.render()
 
-def do_query(console, gateway, source):
-    "Executes the query and formats the result."
+def tableify(keys, max_width, type_codes=(), dbapi=None, timings=None,
+             first_column=0):
+    """Returns a table for the columns `keys`. The renderer of each
+    column is chosen from its type code or its first value. If there
+    are too many columns to shrink them into `max_width`, only the
+    columns from `first_column` on that fit are shown.
+    """
+    renderers = [get_column_renderer(type_code, dbapi)
+                 for type_code in type_codes] or [AutoRenderer() for _ in keys]
+    if len(keys) * MIN_COLUMN_WIDTH <= max_width:
+        first_column = None
+    return Table(zip(keys, renderers), max_width, first_column, timings)
+
+def show_table(console, gateway, keys, type_codes, rows, rows_ready=None,
+               progress=None, timings=None, store=None):
+    """Renders `rows` as table and shows it page by page. The time spent
+    on the table and writing it is added to `timings`, if given. Tables
+    with too many columns can be scrolled horizontally, if `rows` is an
+    iterator its rows have to be recorded in the `store`, see
+    :class:`~eekhoorn.pager.ColumnScroller`.
+    """
+    dbapi = gateway.engine.dialect.dbapi
+    def render(first_column, rows, rows_ready):
+        table = tableify(
+            keys, console.width, type_codes, dbapi, timings, first_column)
+        lines = table.render_stream(rows, SAMPLE_ROWS, rows_ready)
+        if progress is not None:
+            lines = progress.clear_before(lines)
+        return (table, lines)
+    scroller = ColumnScroller(render, rows, rows_ready, store)
+    lines = scroller.render(0)
+    paginate(console, lines, scroller.rows_rendered, timings,
+             scroller if scroller.scrollable else None)
+    table = scroller.table
+    visible = len(table.visible_columns)
+    if visible < len(table.columns):
+        msg = "Showing columns {0:n}-{1:n} of {2:n}\n".format(
+            table.first_column + 1, table.first_column + visible,
+            len(table.columns))
+        sys.stdout.write(green(msg))
+
+def show_view(console, gateway, view):
+    "Shows a :class:`~eekhoorn.result_store.ResultView` of a result."
+    show_table(console, gateway, view.keys, view.type_codes, view)
+    msg = "{0:n} rows".format(len(view))
+    if not view.store.complete:
+        msg += " (only the rows fetched before the pager was quit)"
+    sys.stdout.write(msg + "\n")
+
+def run_query(console, gateway, source, timings=None, connection=None):
+    """Executes the query in a worker thread and formats the result.
+    Pressing C-c cancels the query. Returns whether the query succeeded
+    and a :class:`~eekhoorn.result_store.RowStore` with the rows that
+    were shown or `None`.
+
+    If a :class:`~eekhoorn.timing.Timings` is given as `timings`, the
+    time of each phase of the query is recorded in it and shown. If
+    `connection` is given, the query is executed on it and the worker
+    is done with it when this returns.
+    """
+    # The first batch is just big enough to fill the first page
+    query = gateway.execute_async(
+        source, first_batch_size=console.height, connection=connection)
+    progress = QueryProgress(query)
+    store = None
     try:
-        result = gateway.execute(source)
+        while not query.wait_executed(0.1):
+            progress.update()
+        if query.error is None and query.returns_rows:
+            store = RowStore(query.keys, query.type_codes)
+            rows = store.record(query.iter_rows(on_wait=progress.update))
+            show_table(console, gateway, query.keys, query.type_codes, rows,
+                       lambda: query.rows_buffered > 0, progress, timings,
+                       store)
+        progress.clear()
+        if query.error is not None:
+            raise query.error
+    except KeyboardInterrupt:
+        query.cancel()
+        # Give the worker a chance to release its connection
+        query.join(1)
+        progress.clear()
+        sys.stderr.write(red("Query cancelled after {0:.1f} seconds\n".format(
+            query.elapsed)))
     except sqlalchemy.exc.SQLAlchemyError as exc:
+        progress.clear()
         sys.stderr.write(red(str(exc)))
         sys.stderr.write("\n")
     else:
-        with closing(result):
-            if result.returns_rows:
-                lines = tableify(result, console.width)
-                paginate(console, lines)
         msg = "Query took {0:.4f} seconds".format(gateway.last_query_time)
         sys.stdout.write(msg)
 
-        if result.supports_sane_rowcount() and result.rowcount > -1:
-            sys.stdout.write(" ({0:n} rows)".format(result.rowcount))
+        if query.time_to_first_row is not None:
+            sys.stdout.write(", first row after {0:.4f} seconds".format(
+                query.time_to_first_row))
+
+        if query.rowcount > -1:
+            sys.stdout.write(" ({0:n} rows)".format(query.rowcount))
 
         sys.stdout.write("\n")
+        if timings is not None:
+            timings.add("execute", query.execute_time)
+            timings.add("first_row", query.time_to_first_row)
+            timings.add("fetch", query.fetch_time)
+            sys.stdout.write(green(timings.format()) + "\n")
+        return (True, store)
+    finally:
+        query.close()
+        if connection is not None:
+            # The connection is used for the next statement
+            query.join()
+    if store is not None:
+        store.close()
+    return (False, None)
+
+def do_query(console, gateway, source, timings=None):
+    """Executes a single query, see :func:`run_query`. Returns the
+    :class:`~eekhoorn.result_store.RowStore` with the rows that were
+    shown or `None`.
+    """
+    return run_query(console, gateway, source, timings)[1]
 
+def do_script(console, gateway, statements, transaction=False):
+    """Executes several statements in order on a single connection, like
+    :func:`do_query` does, and shows the result and time of each. Stops
+    at the first failing or cancelled statement. If `transaction` is
+    true, all statements are executed in a single transaction that is
+    rolled back if one of them fails.
+    """
+    start_time = time.time()
+    executed = 0
+    with closing(gateway.engine.connect()) as conn:
+        trans = conn.begin() if transaction else None
+        for (number, statement) in enumerate(statements, 1):
+            sys.stdout.write(green("Statement {0:n} of {1:n}\n".format(
+                number, len(statements))))
+            (ok, store) = run_query(
+                console, gateway, statement, connection=conn)
+            if store is not None:
+                store.close()
+            if not ok:
+                break
+            executed = number
+        if trans is not None:
+            if executed == len(statements):
+                trans.commit()
+            else:
+                trans.rollback()
+    msg = "Executed {0:n} of {1:n} statements in {2:.4f} seconds".format(
+        executed, len(statements), time.time() - start_time)
+    if transaction:
+        if executed == len(statements):
+            msg += " in a single transaction"
+        else:
+            msg += ", rolled back"
+    sys.stdout.write(msg + "\n")
+
+
+def do_batch(args):
+    "Runs the batch mode, see :func:`eekhoorn.batch.run_batch`."
+    # Completion isn't needed, so only load the table names
+    gateway = DatabaseGateway(
+        args.url, lazy=True, batch_size=args.batch_size)
+    if args.file == "-":
+        script = io.open(sys.stdin.fileno(), "r", encoding=ENCODING,
+                         closefd=False)
+    else:
+        script = io.open(args.file, "r", encoding=ENCODING)
+    output = getattr(sys.stdout, "buffer", sys.stdout)
+    with script:
+        return run_batch(
+            gateway, script, get_writer(args.format, output, ENCODING))
 
 
 def main(args=None):
@@ -85,11 +245,45 @@ def main(args=None):
 
     parser = argparse.ArgumentParser()
     parser.add_argument("url")
+    parser.add_argument(
+        "--lazy", action="store_true",
+        help="only load table names on startup, columns on demand")
+    parser.add_argument(
+        "--no-schema-cache", action="store_true",
+        help="always reflect the schema instead of using the on-disk cache")
+    parser.add_argument(
+        "--stats", action="store_true",
+        help="print parse cache statistics on exit")
+    parser.add_argument(
+        "--timings", action="store_true",
+        help="show the time of each phase of a query after it")
+    parser.add_argument(
+        "--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+        help="number of rows fetched from the database at once")
+    parser.add_argument(
+        "-1", "--single-transaction", action="store_true",
+        help="execute all statements entered at once in a single "
+             "transaction")
+    parser.add_argument(
+        "-f", "--file", metavar="FILE",
+        help="execute the statements in FILE ('-' for stdin) without "
+             "prompting and write the results to stdout")
+    parser.add_argument(
+        "--format", choices=sorted(FORMATS), default="csv",
+        help="output format used with --file (default: %(default)s)")
     args = parser.parse_args(args)
 
-    gateway = DatabaseGateway(args.url)
+    if args.file is not None:
+        return do_batch(args)
+
+    cache = None if args.no_schema_cache else SchemaCache()
+    gateway = DatabaseGateway(
+        args.url, lazy=args.lazy, cache=cache, background=True,
+        batch_size=args.batch_size)
     console = UnixConsole(encoding=ENCODING)
     reader = Reader(console=console, gateway=gateway)
+    meta_commands = MetaCommands(
+        partial(show_view, console, gateway), gateway)
     history_path = os.path.expanduser(HISTORY_PATH)
     try:
         with io.open(history_path, "r", encoding="utf-8") as hist_file:
@@ -103,11 +297,26 @@ def main(args=None):
             line = reader.readline(True)
         except EOFError:
             break
+        if is_command(line):
+            try:
+                meta_commands.run(line)
+            except CommandError as exc:
+                sys.stderr.write(red(text_type(exc)) + "\n")
         else:
-            do_query(console, gateway, line)
+            statements = list(iter_statements([line]))
+            if len(statements) > 1:
+                do_script(console, gateway, statements,
+                          args.single_transaction)
+                continue
+            timings = Timings() if args.timings else None
+            store = do_query(console, gateway, line, timings)
+            if store is not None:
+                meta_commands.set_result(store, line)
     with io.open(history_path, "w", encoding="utf-8") as hist_file:
         for line in reader.history:
             hist_file.write(line + "\n")
+    if args.stats:
+        sys.stdout.write(reader.parse_cache.format_stats() + "\n")
 
     return 0
 
@@ -0,0 +1,59 @@
+# encoding: utf-8
+
+"""
+    Headless batch mode: executes the statements of a script without a
+    terminal and writes the results in a machine-readable format.
+"""
+
+from __future__ import unicode_literals
+
+import sys
+from contextlib import closing
+
+import sqlalchemy.exc
+
+from eekhoorn.gateway import iter_batches
+from eekhoorn.sql import get_transaction_control, iter_statements
+
+
+def run_batch(gateway, lines, writer, errors=None):
+    """Executes the statements read from the iterable `lines` in order
+    and writes their results using `writer` (see :mod:`eekhoorn.writers`).
+    Statements are split and executed while reading, rows are fetched
+    and written in batches of the gateway's batch size. All statements
+    are executed on a single connection, so temporary tables, session
+    settings and explicit transactions last until the end of the script.
+
+    Stops at the first failing statement and writes the error to
+    `errors` (``sys.stderr`` by default). Returns the exit status: 0 on
+    success, 1 if a statement failed.
+    """
+    if errors is None:
+        errors = sys.stderr
+    with closing(gateway.engine.connect()) as conn:
+        transaction = None
+        for (number, statement) in enumerate(iter_statements(lines), 1):
+            control = get_transaction_control(statement)
+            if control == "begin" and transaction is None:
+                # Otherwise SQLAlchemy commits after each statement
+                transaction = conn.begin()
+            try:
+                result = gateway.execute(statement, stream=True,
+                                         connection=conn)
+                try:
+                    if result.returns_rows:
+                        writer.start_result(result.keys())
+                        for rows in iter_batches(result, gateway.batch_size):
+                            writer.write_rows(rows)
+                finally:
+                    result.close()
+            except sqlalchemy.exc.SQLAlchemyError as exc:
+                errors.write("Statement {0} failed: {1}\n".format(
+                    number, exc))
+                return 1
+            if control in ("commit", "rollback") and transaction is not None:
+                # The statement ended the transaction already
+                transaction.close()
+                transaction = None
+    writer.flush()
+    return 0
@@ -2,14 +2,18 @@
 
 from __future__ import unicode_literals
 
+from bisect import bisect_left, bisect_right
 from collections import defaultdict, deque
 from functools import partial
+from heapq import merge
+from itertools import chain, groupby
 
-import sqlparse
 from pyrepl import completing_reader
 from six import iteritems, itervalues, next, text_type
 from sqlparse.keywords import KEYWORDS_COMMON
-from sqlparse.sql import Identifier
+from sqlparse.sql import Identifier, TokenList
+
+from eekhoorn.sql import flatten
 
 
 def get_all_identifiers(tokens):
@@ -29,7 +33,7 @@ def get_all_identifiers(tokens):
                     maybe_expand[name].add((parent_name, real_name))
                 else:
                     idents[token.get_name()].add(real_name)
-        elif token.is_group():
+        elif isinstance(token, TokenList):
             tokens.extendleft(token.tokens)
     for (alias, values) in iteritems(maybe_expand):
         for (parent_name, name) in values:
@@ -59,26 +63,100 @@ def get_current_token(tokens, pos):
     return None
 
 
+def _get_column_names(tables, table_name):
+    "Returns a set of the column names of a table or `None`."
+    column_names = getattr(tables, "column_names", None)
+    if column_names is not None:
+        return column_names(table_name)
+    table = tables.get(table_name)
+    if table is None:
+        return None
+    return frozenset(column.name for column in table.columns)
+
+
 def get_unique_column_names(used_idents, tables):
-    #: Mapping column name => table name. Table name is `None` if the
-    # column is found in more than one table
-    columns = {}
-    for real_names in itervalues(used_idents):
-        for table_name in real_names:
-            if "." not in table_name:
-                table = tables.get(table_name)
-                if table is not None:
-                    for column in table.columns:
-                        if column.name not in columns:
-                            columns[column.name] = table_name
-                        elif columns[column.name] != table_name:
-                            columns[column.name] = None
-    for (column_name, table_name) in iteritems(columns):
-        if table_name is not None:
-            yield column_name
-
-
-def get_completions(reader, stem, gateway):
+    "Returns the names of columns found in only one of the used tables."
+    table_names = set(
+        table_name
+        for real_names in itervalues(used_idents)
+        for table_name in real_names
+        if "." not in table_name)
+    column_sets = [_get_column_names(tables, name) for name in table_names]
+    columns = set().union(*filter(None, column_sets))
+    tables_with_column = getattr(tables, "tables_with_column", None)
+    if tables_with_column is not None:
+        # All used tables were reflected by now, so the catalog's index
+        # knows which of them own each column
+        return set(
+            name for name in columns
+            if len(tables_with_column(name) & table_names) == 1)
+    # Plain mappings have no index, find columns of more than one table
+    seen = set()
+    ambiguous = set()
+    for column_names in filter(None, column_sets):
+        ambiguous |= seen & column_names
+        seen |= column_names
+    return columns - ambiguous
+
+
+class PrefixIndex(object):
+    "A sorted list of names that can quickly be searched by prefix."
+
+    def __init__(self, names):
+        self._names = sorted(set(names))
+
+    def find(self, prefix):
+        "Returns a sorted list of all names starting with `prefix`."
+        start = bisect_left(self._names, prefix)
+        end = bisect_right(self._names, prefix + "\uffff", start)
+        return self._names[start:end]
+
+
+class CompletionIndex(object):
+    """Prefix indexes for keywords, tables and columns. The index of
+    keywords and tables is rebuilt when the set of tables changes, the
+    index of a table's columns when the table is reflected again.
+    """
+
+    def __init__(self):
+        self._tables = None
+        self._revision = None
+        self._index = None
+        #: Mapping table name => (table, index of the table's columns)
+        self._column_indexes = {}
+
+    def _check_schema(self, tables):
+        # Plain mappings have no revision, so they are always reindexed
+        revision = getattr(tables, "revision", None)
+        if (tables is not self._tables or revision is None
+                or revision != self._revision):
+            self._tables = tables
+            self._revision = revision
+            self._index = None
+            self._column_indexes = {}
+
+    def find(self, tables, prefix):
+        "Returns all keywords and table names starting with `prefix`."
+        self._check_schema(tables)
+        if self._index is None:
+            self._index = PrefixIndex(chain(KEYWORDS_COMMON, tables))
+        return self._index.find(prefix)
+
+    def find_columns(self, tables, table_name, prefix):
+        "Returns all columns of a table starting with `prefix`."
+        self._check_schema(tables)
+        table = tables.get(table_name)
+        if table is None:
+            return []
+        (indexed_table, index) = self._column_indexes.get(
+            table_name, (None, None))
+        if indexed_table is not table:
+            index = PrefixIndex(column.name for column in table.columns)
+            self._column_indexes[table_name] = (table, index)
+        return index.find(prefix)
+
+
+def get_completions(reader, stem, gateway, index=None):
     "Returns a list of possible completions."
     def extend(iterable):
         """Extends the set of suggestions with items from `iterable`. Filters
@@ -86,35 +164,33 @@ def get_completions(reader, stem, gateway):
         """
         suggestions.update(
             item for item in iterable if item.startswith(stem))
+    if index is None:
+        index = CompletionIndex()
     suggestions = set()
     tables = gateway.tables
-    stmt = sqlparse.parse(reader.get_unicode())[0]
-    idents = get_all_identifiers(stmt.tokens)
-    token = get_current_token(stmt.flatten(), reader.pos)
+    tokens = reader.parse_cache.get_tokens(reader.get_unicode())
+    idents = get_all_identifiers(tokens)
+    token = get_current_token(flatten(tokens), reader.pos)
     if token and isinstance(token.parent, Identifier):
         token = token.parent
-    add_all = True
     if isinstance(token, Identifier):
         parent_name = token.get_parent_name()
         if parent_name:
-            add_all = False
             if parent_name in idents:
                 parent_name = next(iter(idents.get(parent_name)))
-            table = tables.get(parent_name)
-            if table is not None:
-                extend(column.name for column in table.columns)
-    if add_all:
-        extend(KEYWORDS_COMMON)
-        extend(tables)
-        extend(idents)
-        extend(get_unique_column_names(idents, tables))
-        if stem in suggestions:
-            # No real point in suggesting the same thing that is
-            # already entered and it can lead to false results as
-            # sqlparse might recognize unfinished keywords as
-            # identifiers
-            suggestions.remove(stem)
-    return sorted(suggestions)
+            return index.find_columns(tables, parent_name, stem)
+    extend(idents)
+    extend(get_unique_column_names(idents, tables))
+    # The index's result is already sorted, only sort the few
+    # statement-specific suggestions and merge both
+    return [
+        name for (name, _) in groupby(
+            merge(index.find(tables, stem), sorted(suggestions)))
+        # No real point in suggesting the same thing that is
+        # already entered and it can lead to false results as
+        # sqlparse might recognize unfinished keywords as
+        # identifiers
+        if name != stem]
 
 
 class CompletingReader(completing_reader.CompletingReader):
@@ -123,4 +199,6 @@ class CompletingReader(completing_reader.CompletingReader):
 
     def __init__(self, gateway, **kwargs):
         super(CompletingReader, self).__init__(**kwargs)
-        self.get_completions = partial(get_completions, self, gateway=gateway)
+        self.gateway = gateway
+        self.get_completions = partial(
+            get_completions, self, gateway=gateway, index=CompletionIndex())
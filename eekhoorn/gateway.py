@@ -1,26 +1,393 @@
 # encoding: utf-8
 
+import bisect
+import threading
 import time
+from collections import defaultdict
+from contextlib import closing
+from itertools import islice
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
 
 import sqlalchemy
+import sqlalchemy.exc
+from six.moves import queue
 from sqlalchemy import event
+from sqlalchemy.pool import StaticPool
+
+from eekhoorn.schema_cache import get_schema_fingerprint
+
+
+#: Number of rows fetched from the database at once
+DEFAULT_BATCH_SIZE = 1000
+
+
+def iter_batches(rows, size):
+    """Iterates over the rows of `rows` in lists of up to `size` rows.
+    Results are fetched with ``fetchmany``, other iterables are split.
+    """
+    fetchmany = getattr(rows, "fetchmany", None)
+    if fetchmany is None:
+        rows = iter(rows)
+        fetchmany = lambda size: list(islice(rows, size))
+    while True:
+        batch = fetchmany(size)
+        if not batch:
+            break
+        yield batch
+
+
+def create_engine(url):
+    """Creates an engine for `url`. Queries are executed in worker
+    threads, so SQLite connections may be used by other threads than
+    the one that opened them. In-memory SQLite databases share a single
+    connection, as every connection would get its own database.
+    """
+    url = sqlalchemy.engine.url.make_url(url)
+    if url.get_backend_name() != "sqlite":
+        return sqlalchemy.create_engine(url)
+    connect_args = {"check_same_thread": False}
+    if url.database in (None, "", ":memory:"):
+        return sqlalchemy.create_engine(
+            url, poolclass=StaticPool, connect_args=connect_args)
+    return sqlalchemy.create_engine(url, connect_args=connect_args)
+
+
+class TableCatalog(Mapping):
+    """Mapping table name => :class:`sqlalchemy.Table`. Tables that are
+    not yet known are reflected on first access using `reflect` and
+    memoized afterwards.
+
+    The catalog can safely be filled from another thread while it is
+    in use, iterating over it returns the tables known at that time.
+
+    For every reflected table, the catalog also indexes the names of its
+    columns, both per table and as column name => table names.
+    """
+
+    def __init__(self, names, reflect):
+        #: Incremented whenever the set of table names changes
+        self.revision = 0
+        self._names = sorted(names)
+        self._known = set(self._names)
+        self._tables = {}
+        self._reflect = reflect
+        self._lock = threading.Lock()
+        #: Mapping table name => frozenset of column names
+        self._column_names = {}
+        #: Mapping column name => set of table names
+        self._tables_by_column = defaultdict(set)
+
+    def __getitem__(self, name):
+        try:
+            return self._tables[name]
+        except KeyError:
+            if name not in self._known:
+                raise
+        try:
+            table = self._reflect(name)
+        except sqlalchemy.exc.NoSuchTableError:
+            # The table was dropped, treat it as unknown from now on
+            self._discard(name)
+            raise KeyError(name)
+        except sqlalchemy.exc.SQLAlchemyError:
+            # E.g. a lost connection, the table is tried again next time
+            raise KeyError(name)
+        with self._lock:
+            if name not in self._tables:
+                self._tables[name] = table
+                self._index_columns(table)
+            return self._tables[name]
+
+    def __contains__(self, name):
+        return name in self._known
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._names))
+
+    def __len__(self):
+        return len(self._names)
+
+    def add_names(self, names):
+        "Adds the names of tables that are reflected on first access."
+        with self._lock:
+            self._known.update(names)
+            self._names = sorted(self._known)
+            self.revision += 1
+
+    def _discard(self, name):
+        with self._lock:
+            if name in self._known:
+                self._known.discard(name)
+                self._names.remove(name)
+                self.revision += 1
+
+    def add(self, table):
+        "Adds an already reflected table to the catalog."
+        with self._lock:
+            if table.name not in self._known:
+                self._known.add(table.name)
+                bisect.insort(self._names, table.name)
+                self.revision += 1
+            self._tables[table.name] = table
+            self._index_columns(table)
+
+    def _index_columns(self, table):
+        for column_name in self._column_names.get(table.name, ()):
+            table_names = self._tables_by_column[column_name]
+            table_names.discard(table.name)
+            if not table_names:
+                del self._tables_by_column[column_name]
+        column_names = frozenset(column.name for column in table.columns)
+        self._column_names[table.name] = column_names
+        for column_name in column_names:
+            self._tables_by_column[column_name].add(table.name)
+
+    def is_loaded(self, name):
+        "Returns whether the given table was already reflected."
+        return name in self._tables
+
+    def column_names(self, name):
+        """Returns a frozenset of the column names of table `name`, or
+        `None` if there is no such table.
+        """
+        if self.get(name) is None:
+            return None
+        return self._column_names[name]
+
+    def tables_with_column(self, column_name):
+        """Returns a frozenset of the names of all reflected tables that
+        have a column `column_name`.
+        """
+        with self._lock:
+            return frozenset(self._tables_by_column.get(column_name, ()))
+
+
+class QueryCancelled(Exception):
+    "Raised when iterating over the rows of a cancelled query."
+
+
+class RunningQuery(object):
+    """A query that is executed in a worker thread. The worker fetches the
+    rows in batches and hands them over through a bounded queue, so it
+    stays at most `max_batches` batches ahead of the consumer.
+
+    The first batch holds only `first_batch_size` rows, so that the
+    first rows can be shown before a whole batch arrived.
+
+    The query is executed on a new connection, unless one is given as
+    `connection`. That connection is left open, but it must not be used
+    until the worker is done with it, see :meth:`join`.
+
+    Use :meth:`iter_rows` to consume the rows and :meth:`cancel` to
+    cancel the query on the server.
+    """
+
+    #: Marks the end of the rows in the queue
+    _DONE = object()
+
+    def __init__(self, gateway, query, max_batches=4, first_batch_size=None,
+                 connection=None):
+        self.gateway = gateway
+        self.query = query
+        self.connection = connection
+        self.first_batch_size = first_batch_size or gateway.batch_size
+        self.start_time = time.time()
+        #: Seconds until the query was executed, until the first row was
+        #: fetched and spent fetching rows in total, `None` if unknown
+        self.execute_time = None
+        self.time_to_first_row = None
+        self.fetch_time = None
+        #: Number of rows fetched from the database so far
+        self.rows_fetched = 0
+        #: Number of rows returned by :meth:`iter_rows` so far
+        self.rows_consumed = 0
+        #: Exception raised by the query or `None`
+        self.error = None
+        #: Whether the query returns rows, column names, DB-API type
+        #: codes of the columns and row count, available once
+        #: :meth:`wait_executed` returns true
+        self.returns_rows = False
+        self.keys = []
+        self.type_codes = []
+        self.rowcount = -1
+        self.cancelled = False
+        self._dbapi_connection = None
+        self._batches = queue.Queue(max_batches)
+        self._executed = threading.Event()
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def elapsed(self):
+        "Seconds since the query was started."
+        return time.time() - self.start_time
+
+    def _run(self):
+        try:
+            if self.connection is not None:
+                self._execute(self.connection)
+            else:
+                with closing(self.gateway.engine.connect()) as conn:
+                    self._execute(conn)
+        except Exception as exc:
+            self.error = exc
+        finally:
+            self._dbapi_connection = None
+            self._executed.set()
+            self._put(self._DONE)
+
+    def _execute(self, conn):
+        self._dbapi_connection = conn.connection.connection
+        conn = conn.execution_options(stream_results=True)
+        with closing(conn.execute(self.query)) as result:
+            self.returns_rows = result.returns_rows
+            if result.returns_rows:
+                self.keys = result.keys()
+                self.type_codes = [
+                    column[1] for column in result.cursor.description]
+            elif result.supports_sane_rowcount():
+                self.rowcount = result.rowcount
+            self.execute_time = self.elapsed
+            self._executed.set()
+            if not result.returns_rows:
+                return
+            batch_size = self.first_batch_size
+            self.fetch_time = 0.0
+            while not self._closed.is_set():
+                start = time.time()
+                rows = result.fetchmany(batch_size)
+                self.fetch_time += time.time() - start
+                if not rows:
+                    break
+                if self.time_to_first_row is None:
+                    self.time_to_first_row = self.elapsed
+                self.rows_fetched += len(rows)
+                self._put(rows)
+                batch_size = self.gateway.batch_size
+
+    def _put(self, item):
+        while not self._closed.is_set():
+            try:
+                self._batches.put(item, timeout=0.1)
+            except queue.Full:
+                continue
+            return
+
+    @property
+    def rows_buffered(self):
+        "Number of rows fetched but not yet returned by :meth:`iter_rows`."
+        return self.rows_fetched - self.rows_consumed
+
+    def wait_executed(self, timeout=None):
+        """Blocks until the query was executed (but not necessarily all
+        rows were fetched). Returns whether that happened in `timeout`
+        seconds.
+        """
+        return self._executed.wait(timeout)
+
+    def _iter_batches(self, on_wait):
+        while True:
+            try:
+                batch = self._batches.get(timeout=0.1)
+            except queue.Empty:
+                if on_wait is not None:
+                    on_wait()
+                continue
+            if batch is self._DONE:
+                break
+            yield batch
+        if self.cancelled:
+            raise QueryCancelled()
+        elif self.error is not None:
+            raise self.error
+
+    def iter_rows(self, on_wait=None):
+        """Iterates over the rows. `on_wait` is called regularly while
+        waiting for the database. Raises the query's exception, if any.
+        """
+        for batch in self._iter_batches(on_wait):
+            for row in batch:
+                self.rows_consumed += 1
+                yield row
+
+    def iter_batches(self, on_wait=None):
+        "Like :meth:`iter_rows`, but iterates over lists of rows."
+        for batch in self._iter_batches(on_wait):
+            self.rows_consumed += len(batch)
+            yield batch
+
+    def cancel(self):
+        """Cancels the query on the server if it is still running and
+        stops fetching rows.
+        """
+        self.cancelled = True
+        dbapi_connection = self._dbapi_connection
+        if dbapi_connection is not None:
+            self.gateway.cancel(dbapi_connection)
+        self.close()
+
+    def close(self):
+        "Stops fetching rows and releases the connection."
+        self._closed.set()
+        # Make sure the consumer sees the end of the rows
+        self._batches = queue.Queue()
+        self._batches.put(self._DONE)
+
+    def join(self, timeout=None):
+        "Waits until the worker released its connection."
+        self._thread.join(timeout)
 
 
 class DatabaseGateway(object):
     """Gateway for talking to the database.
+
+    If `lazy` is true, only the names of the tables are loaded upfront.
+    The columns of a table are reflected the first time the table is
+    looked up in :attr:`tables`.
+
+    If a :class:`~eekhoorn.schema_cache.SchemaCache` is given as `cache`,
+    the schema is loaded from it as long as the database's schema
+    fingerprint didn't change.
+
+    If `background` is true, the schema is loaded in a background thread
+    and :attr:`tables` is filled while the gateway is already in use.
+
+    Results are fetched in batches of `batch_size` rows by
+    :meth:`fetch_rows`.
     """
 
-    def __init__(self, url):
-        self.engine = sqlalchemy.create_engine(url)
+    def __init__(self, url, lazy=False, cache=None, background=False,
+                 batch_size=DEFAULT_BATCH_SIZE):
+        self.engine = create_engine(url)
+        self.batch_size = batch_size
         #: Time that the last query took or `None`.
         self.last_query_time = None
+        #: Exception raised while loading the schema or `None`.
+        self.schema_error = None
         self.metadata = sqlalchemy.MetaData()
         self.metadata.bind = self.engine
-        self.metadata.reflect()
+        self._tables = TableCatalog([], self._reflect_table)
+        self._reflect_lock = threading.RLock()
+        self._schema_loaded = threading.Event()
+        self._schema_thread = None
+        if background:
+            self._schema_thread = threading.Thread(
+                target=self._load_schema_in_background, args=(lazy, cache))
+            self._schema_thread.daemon = True
+        else:
+            self._load_schema(lazy, cache)
         event.listen(
             self.engine, "before_cursor_execute", self._on_before_execute)
         event.listen(
             self.engine, "after_cursor_execute", self._on_after_execute)
+        if self._schema_thread is not None:
+            self._schema_thread.start()
 
     def _on_before_execute(self, conn, cursor, statement, parameters,
                            context, executemany):
@@ -28,12 +395,121 @@ class DatabaseGateway(object):
 
     def _on_after_execute(self, conn, cursor, statement, parameters,
                           context, executemany):
+        if threading.current_thread() is self._schema_thread:
+            # Don't report the time of queries used for reflection
+            return
         self.last_query_time = time.time() - context._query_start_time
 
+    def _load_schema(self, lazy, cache):
+        try:
+            self._load_schema_tables(lazy, cache)
+        finally:
+            self._schema_loaded.set()
+
+    def _load_schema_in_background(self, lazy, cache):
+        try:
+            self._load_schema(lazy, cache)
+        except Exception as exc:
+            self.schema_error = exc
+
+    def _load_schema_tables(self, lazy, cache):
+        fingerprint = None
+        if cache is not None:
+            fingerprint = get_schema_fingerprint(self.engine)
+        if fingerprint is not None:
+            cached_tables = cache.load(self.engine.url, fingerprint)
+            if cached_tables is not None:
+                with self._reflect_lock:
+                    for (name, columns) in cached_tables.items():
+                        columns = [sqlalchemy.Column(c) for c in columns]
+                        self._tables.add(
+                            sqlalchemy.Table(name, self.metadata, *columns))
+                return
+        names = sqlalchemy.inspect(self.engine).get_table_names()
+        if lazy:
+            self._tables.add_names(names)
+            return
+        for name in names:
+            # One table at a time, so that the catalog fills progressively
+            self._tables.add(self._reflect_table(name))
+        if fingerprint is not None:
+            cache.save(self.engine.url, fingerprint, dict(
+                (name, [column.name for column in self._tables[name].columns])
+                for name in names))
+
+    def _reflect_table(self, name):
+        with self._reflect_lock:
+            return sqlalchemy.Table(name, self.metadata, autoload=True)
+
+    def reflect_table(self, name):
+        """Reflects the table `name` again, even if it is already known,
+        and updates :attr:`tables`. Tables loaded from the schema cache
+        only know their column names, this also loads the columns' types.
+        """
+        with self._reflect_lock:
+            table = sqlalchemy.Table(
+                name, self.metadata, autoload=True, extend_existing=True)
+        self._tables.add(table)
+        return table
+
+    @property
+    def schema_loading(self):
+        "Whether the schema is still being loaded in the background."
+        return not self._schema_loaded.is_set()
+
+    def wait_for_schema(self, timeout=None):
+        """Blocks until the schema is loaded. Returns whether it finished
+        loading within `timeout` seconds.
+        """
+        return self._schema_loaded.wait(timeout)
+
     @property
     def tables(self):
-        "Returns the name of the tables that exist in the current database."
-        return self.metadata.tables
+        "Returns the tables that exist in the current database."
+        return self._tables
+
+    def tables_with_column(self, column_name):
+        """Returns the names of all tables loaded so far that have a
+        column named `column_name`.
+        """
+        return self._tables.tables_with_column(column_name)
+
+    def execute(self, query, stream=False, connection=None):
+        """Executes `query`. If `stream` is true, a server-side cursor is
+        used if the dialect supports it, so that the rows are only
+        transferred when they are fetched. If `connection` is given, the
+        query is executed on it instead of a connection from the pool.
+        """
+        bind = self.engine if connection is None else connection
+        if stream:
+            bind = bind.execution_options(stream_results=True)
+        return bind.execute(query)
+
+    def execute_async(self, query, first_batch_size=None, connection=None):
+        "Executes `query` in a worker thread, see :class:`RunningQuery`."
+        return RunningQuery(self, query, first_batch_size=first_batch_size,
+                            connection=connection)
+
+    def cancel(self, dbapi_connection):
+        """Cancels the query currently executed by `dbapi_connection`.
+        Returns whether the dialect supports cancelling queries.
+        """
+        dialect = self.engine.dialect.name
+        if dialect == "sqlite":
+            dbapi_connection.interrupt()
+        elif dialect == "mysql" and hasattr(dbapi_connection, "thread_id"):
+            # Has to be sent using another connection
+            self.engine.execute(
+                "KILL QUERY {0:d}".format(dbapi_connection.thread_id()))
+        elif hasattr(dbapi_connection, "cancel"):
+            # psycopg2, cx_Oracle and others
+            dbapi_connection.cancel()
+        else:
+            return False
+        return True
 
-    def execute(self, query):
-        return self.engine.execute(query)
+    def fetch_rows(self, result):
+        "Iterates over the rows of `result`, fetching them in batches."
+        for rows in iter_batches(result, self.batch_size):
+            for row in rows:
+                yield row
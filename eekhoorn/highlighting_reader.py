@@ -11,7 +11,7 @@ from six.moves import xrange
 from sqlparse import sql
 from sqlparse.tokens import Token
 
-from eekhoorn.sql import get_tokens, flatten
+from eekhoorn.sql import ParseCache, flatten
 
 
 _disp_str = pyrepl.reader.disp_str
@@ -21,7 +21,9 @@ STYLE = {
     Token: ("", ""),
     Token.Comment: (42, "italic"),
     Token.Keyword: (23, "bold"),
-    Token.Error: ("red", "")
+    Token.Error: ("red", ""),
+    # Statements after the first one are executed as well
+    Token.Error.Next: ("", ""),
 }
 
 def format_token(token):
@@ -62,15 +64,16 @@ def _add_line_part(
     leftovers = []
     tokens_iter = iter(tokens)
     for token in tokens_iter:
+        # Tokens are cached by the tokenizer, hence don't modify them
+        value = token.value
         chars_left = width - total_length
-        value_length = len(token.value)
+        value_length = len(value)
         if width >= 0 and chars_left < value_length:
-            leftovers.append(sql.Token(token.ttype, token.value[chars_left:]))
-            token.value = token.value[:chars_left]
+            leftovers.append(sql.Token(token.ttype, value[chars_left:]))
+            value = value[:chars_left]
         total_length += value_length
-        (part, part_info) = _disp_str(token.value)
-        token.value = part
-        l += format_token(token)
+        (part, part_info) = _disp_str(value)
+        l += format_token(sql.Token(token.ttype, part))
         l2.extend(part_info)
         if leftovers:
             break
@@ -87,6 +90,11 @@ class HighlightingReader(pyrepl.reader.Reader):
 
     wrap_sign = "\N{LEFTWARDS ARROW WITH HOOK}"
 
+    def __init__(self, console):
+        super(HighlightingReader, self).__init__(console)
+        #: Shared by everything that needs the tokens of the buffer
+        self.parse_cache = ParseCache()
+
     def calc_screen(self):
         # c/p from pyrepl.reader.Reader with added highlighting
         # XXX This is a mess
@@ -103,7 +111,7 @@ class HighlightingReader(pyrepl.reader.Reader):
         screen = []
         screeninfo = []
         input = self.get_unicode()
-        tokens = get_tokens(input)
+        tokens = self.parse_cache.tokenize(input)
         # One char left for the wrap sign
         w = self.console.width - 1
         pos = self.pos
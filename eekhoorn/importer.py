@@ -0,0 +1,176 @@
+# encoding: utf-8
+
+"""
+    Bulk import of CSV files into existing tables. The file is read as a
+    stream and inserted in batches using ``executemany``, all inside a
+    single transaction.
+"""
+
+from __future__ import unicode_literals
+
+import binascii
+import csv
+import datetime
+import decimal
+import io
+
+import sqlalchemy.exc
+import sqlalchemy.types
+from six import PY2, string_types, text_type
+
+from eekhoorn.gateway import iter_batches
+
+
+class CsvImportError(Exception):
+    "Raised if a CSV file can't be imported."
+
+
+_TRUE = frozenset(["1", "t", "true", "y", "yes", "on"])
+_FALSE = frozenset(["0", "f", "false", "n", "no", "off"])
+
+_DATETIME_FORMATS = [
+    "%Y-%m-%d %H:%M:%S.%f",
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%dT%H:%M:%S.%f",
+    "%Y-%m-%dT%H:%M:%S",
+    "%Y-%m-%d %H:%M",
+    "%Y-%m-%d",
+]
+
+_TIME_FORMATS = ["%H:%M:%S.%f", "%H:%M:%S", "%H:%M"]
+
+
+def _parse(text, formats):
+    for format in formats:
+        try:
+            return datetime.datetime.strptime(text, format)
+        except ValueError:
+            continue
+    raise ValueError("invalid date or time: {0!r}".format(text))
+
+
+def _to_bool(text):
+    lowered = text.lower()
+    if lowered in _TRUE:
+        return True
+    elif lowered in _FALSE:
+        return False
+    raise ValueError("invalid boolean: {0!r}".format(text))
+
+
+def _to_binary(text):
+    if text.startswith("\\x"):
+        text = text[2:]
+    return binascii.unhexlify(text.encode("ascii"))
+
+
+#: Converters from text by the Python type of a column. bool is a
+#: subclass of int and datetime one of date, so they come first.
+_CONVERTERS = [
+    (bool, _to_bool),
+    (int, int),
+    (float, float),
+    (decimal.Decimal, decimal.Decimal),
+    (datetime.datetime, lambda text: _parse(text, _DATETIME_FORMATS)),
+    (datetime.date, lambda text: _parse(text, _DATETIME_FORMATS).date()),
+    (datetime.time, lambda text: _parse(text, _TIME_FORMATS).time()),
+    (bytes, _to_binary),
+]
+
+
+def get_converter(column_type):
+    """Returns a function that converts the text of a CSV field to a
+    value for a column of the SQLAlchemy type `column_type`. Empty fields
+    are converted to NULL, except for text columns.
+    """
+    try:
+        python_type = column_type.python_type
+    except NotImplementedError:
+        python_type = text_type
+    if issubclass(python_type, string_types):
+        return lambda text: text
+    for (type_, converter) in _CONVERTERS:
+        if issubclass(python_type, type_):
+            return lambda text: converter(text) if text != "" else None
+    return lambda text: text
+
+
+def _has_types(table):
+    return not any(
+        isinstance(column.type, sqlalchemy.types.NullType)
+        for column in table.columns)
+
+
+def get_table(gateway, name):
+    """Returns the table `name` with the types of its columns. Tables
+    that aren't known yet, e.g. because they were just created, or that
+    were loaded from the schema cache without types are reflected again.
+    """
+    table = gateway.tables.get(name)
+    if table is None or not _has_types(table):
+        try:
+            table = gateway.reflect_table(name)
+        except sqlalchemy.exc.NoSuchTableError:
+            raise CsvImportError("Unknown table: {0}".format(name))
+    return table
+
+
+def _read_csv(path, encoding):
+    if PY2:
+        with io.open(path, "rb") as f:
+            for row in csv.reader(f):
+                yield [field.decode(encoding) for field in row]
+    else:
+        with io.open(path, "r", encoding=encoding, newline="") as f:
+            for row in csv.reader(f):
+                yield row
+
+
+def import_csv(gateway, path, table_name, batch_size=None,
+               encoding="utf-8", progress=None):
+    """Inserts the rows of the CSV file `path` into the table
+    `table_name`. The first line of the file names the columns, the
+    fields are converted to the columns' types using
+    :func:`get_converter`.
+
+    The rows are inserted in ``executemany`` batches of `batch_size`
+    rows (the gateway's batch size by default) in a single transaction,
+    so that either all or none of the rows are imported. `progress` is
+    called with the number of rows inserted so far after every batch.
+
+    Returns the number of rows inserted. Raises :class:`CsvImportError`
+    for invalid files.
+    """
+    table = get_table(gateway, table_name)
+    batch_size = batch_size or gateway.batch_size
+    rows = _read_csv(path, encoding)
+    try:
+        header = next(rows)
+    except StopIteration:
+        raise CsvImportError("{0} is empty".format(path))
+    unknown = [name for name in header if name not in table.columns]
+    if unknown:
+        raise CsvImportError("Unknown columns in {0}: {1}".format(
+            table_name, ", ".join(unknown)))
+    converters = [get_converter(table.columns[name].type) for name in header]
+    statement = table.insert()
+    count = 0
+    with gateway.engine.begin() as conn:
+        for batch in iter_batches(rows, batch_size):
+            params = []
+            for (number, row) in enumerate(batch, count + 1):
+                if len(row) != len(header):
+                    raise CsvImportError(
+                        "Row {0}: expected {1} fields, got {2}".format(
+                            number, len(header), len(row)))
+                try:
+                    params.append(dict(zip(
+                        header, [f(v) for (f, v) in zip(converters, row)])))
+                except (ValueError, TypeError, decimal.InvalidOperation,
+                        binascii.Error) as exc:
+                    raise CsvImportError("Row {0}: {1}".format(number, exc))
+            conn.execute(statement, params)
+            count += len(batch)
+            if progress is not None:
+                progress(count)
+    return count
@@ -0,0 +1,348 @@
+# encoding: utf-8
+
+"""
+    Meta-commands: console commands that start with a backslash and are
+    handled by eekhoorn itself instead of being sent to the database.
+"""
+
+from __future__ import unicode_literals
+
+import io
+import operator
+import os
+import re
+import sys
+import time
+
+import sqlalchemy.exc
+import sqlparse
+from six import text_type
+
+from eekhoorn.gateway import DEFAULT_BATCH_SIZE, QueryCancelled, iter_batches
+from eekhoorn.importer import CsvImportError, import_csv
+from eekhoorn.renderers import NUMERIC_TYPES
+from eekhoorn.result_store import ResultView
+from eekhoorn.writers import EXTENSIONS, FORMATS, get_writer
+
+
+class CommandError(Exception):
+    "Raised if a meta-command can't be executed."
+
+
+def is_command(source):
+    "Returns whether `source` is a meta-command."
+    return source.lstrip().startswith("\\")
+
+
+_OPERATORS = {
+    "=": operator.eq,
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<>": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+
+_CONDITION_RE = re.compile(
+    r"^\s*(.+?)\s*(==|!=|<>|<=|>=|=|<|>|~)\s*(.*?)\s*$")
+
+
+def _parse_literal(literal):
+    """Returns the value of a literal in a filter expression: `None` for
+    NULL, the text of quoted strings and the literal itself otherwise.
+    """
+    if literal.upper() == "NULL":
+        return None
+    elif len(literal) > 1 and literal[0] in "'\"":
+        if literal[-1] == literal[0]:
+            return literal[1:-1]
+    return literal
+
+
+def _to_number(literal):
+    try:
+        return float(literal)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_filter(view, expression):
+    """Returns a predicate for the full rows of `view`. `expression` is
+    either a condition like ``column op value``, where op is one of
+    ``= != < <= > >=`` or ``~`` for a case-insensitive regular
+    expression search, or just text that is searched for in all
+    columns.
+    """
+    match = _CONDITION_RE.match(expression)
+    if match is None or match.group(1) not in view.store.keys:
+        needle = expression.strip().lower()
+        columns = view.columns
+        return lambda row: any(
+            needle in text_type(row[x]).lower()
+            for x in columns if row[x] is not None)
+    (name, op, literal) = match.groups()
+    x = view.column_index(name)
+    value = _parse_literal(literal)
+    if op == "~":
+        if value is None:
+            raise CommandError("Can't search for NULL")
+        try:
+            regex = re.compile(value, re.IGNORECASE)
+        except re.error as exc:
+            raise CommandError("Invalid regular expression: {0}".format(exc))
+        return lambda row: (
+            row[x] is not None and regex.search(text_type(row[x])) is not None)
+    compare = _OPERATORS[op]
+    if value is None:
+        if compare not in (operator.eq, operator.ne):
+            raise CommandError("NULL can only be compared with = and !=")
+        return lambda row: compare(row[x], None)
+    number = _to_number(value) if literal == value else None
+
+    def predicate(row):
+        cell = row[x]
+        if cell is None:
+            return False
+        elif number is not None and isinstance(cell, NUMERIC_TYPES):
+            return compare(cell, number)
+        return compare(text_type(cell), value)
+    return predicate
+
+
+def _is_select(source):
+    "Returns whether `source` is a SELECT query without side effects."
+    if not source:
+        return False
+    statements = sqlparse.parse(source)
+    return len(statements) == 1 and statements[0].get_type() == "SELECT"
+
+
+class _Progress(object):
+    """Reports how many rows a command processed so far and how fast,
+    at most every :attr:`interval` seconds, using `report`. `verb` is
+    the past tense of what the command does with the rows.
+    """
+
+    interval = 0.25
+
+    def __init__(self, report, verb):
+        self.report = report
+        self.verb = verb
+        self.start_time = time.time()
+        self._last_report = self.start_time
+
+    def __call__(self, rows):
+        if time.time() - self._last_report > self.interval:
+            self._last_report = time.time()
+            self.report("{0} {1:n} rows ({2:,.0f} rows/s)".format(
+                self.verb, rows, rows / self._elapsed()))
+
+    def _elapsed(self):
+        return max(time.time() - self.start_time, 1e-6)
+
+    def finish(self, rows, target):
+        "Reports that all `rows` were processed, e.g. ``to <path>``."
+        elapsed = self._elapsed()
+        self.report(
+            "{0} {1:n} rows {2} in {3:.2f} seconds ({4:,.0f} rows/s)".format(
+                self.verb, rows, target, elapsed, rows / elapsed),
+            final=True)
+
+
+class MetaCommands(object):
+    """Executes meta-commands. Most of them work on the result of the
+    last query, which is kept in a
+    :class:`~eekhoorn.result_store.RowStore`, and show a new view of it
+    using `show`, so that no database round trip is needed. Commands
+    that talk to the database use `gateway` and report to `output`.
+    """
+
+    def __init__(self, show, gateway=None, output=None):
+        self.show = show
+        self.gateway = gateway
+        self.output = sys.stdout if output is None else output
+        #: The view of the last result that was shown
+        self.view = None
+        #: The query that returned the last result
+        self.source = None
+
+    def set_result(self, store, source=None):
+        """Sets the result that the commands work on and the query
+        `source` that returned it.
+        """
+        if self.view is not None:
+            self.view.store.close()
+        self.view = ResultView(store)
+        self.source = source
+
+    def run(self, source):
+        "Executes the meta-command `source`."
+        (name, _, args) = source.strip().rstrip(";").partition(" ")
+        method = getattr(self, "do_" + name[1:], None)
+        if method is None:
+            raise CommandError("Unknown command: {0}".format(name))
+        method(args.strip())
+
+    def _get_view(self):
+        if self.view is None:
+            raise CommandError("There is no result yet")
+        return self.view
+
+    def _show(self, view):
+        self.view = view
+        self.show(view)
+
+    def do_sort(self, args):
+        """\\sort column [desc]: sorts the last result by a column."""
+        view = self._get_view()
+        (name, _, direction) = args.rpartition(" ")
+        if direction.lower() not in ("asc", "desc"):
+            (name, direction) = (args, "asc")
+        try:
+            view = view.sorted(name.strip(), direction.lower() == "desc")
+        except KeyError:
+            raise CommandError("Unknown column: {0}".format(name))
+        self._show(view)
+
+    def do_filter(self, args):
+        """\\filter expression: shows only the rows of the last result
+        that match the expression, see :func:`parse_filter`.
+        """
+        view = self._get_view()
+        if not args:
+            raise CommandError("Usage: \\filter column op value")
+        self._show(view.filtered(parse_filter(view, args)))
+
+    def do_cols(self, args):
+        """\\cols a,b: shows only the given columns of the last result,
+        all columns if none are given.
+        """
+        view = self._get_view()
+        names = [name.strip() for name in args.split(",") if name.strip()]
+        if not names:
+            names = view.store.keys
+        try:
+            view = view.projected(names)
+        except KeyError as exc:
+            raise CommandError("Unknown column: {0}".format(exc.args[0]))
+        self._show(view)
+
+    def do_reset(self, args):
+        """\\reset: shows the last result as it was returned."""
+        self._show(ResultView(self._get_view().store))
+
+    def _report(self, msg, final=False):
+        self.output.write("\r" + msg + ("\n" if final else ""))
+        self.output.flush()
+
+    def do_export(self, args):
+        """\\export path [format]: writes the last result to a file. The
+        format is one of :data:`~eekhoorn.writers.FORMATS` and defaults
+        to the one matching the file's extension or CSV.
+
+        If all rows of the result were fetched, the current view of
+        them (see \\sort, \\filter and \\cols) is written. Otherwise
+        the query is executed again and all its rows are written batch
+        by batch as they are fetched, which is only done for SELECT
+        queries. Only the columns of the view are written then, the
+        view must not be sorted or filtered.
+        """
+        view = self._get_view()
+        (path, _, format) = args.rpartition(" ")
+        if format not in FORMATS:
+            (path, format) = (args, None)
+        path = path.strip()
+        if not path:
+            raise CommandError("Usage: \\export path [format]")
+        if format is None:
+            extension = os.path.splitext(path)[1].lower()
+            format = EXTENSIONS.get(extension, "csv")
+        query = None
+        if not view.store.complete:
+            if self.gateway is None or not _is_select(self.source):
+                raise CommandError(
+                    "Only {0:n} rows of the result were fetched and the "
+                    "query isn't a SELECT, so it isn't executed "
+                    "again".format(len(view.store)))
+            if view.indexes is not None:
+                raise CommandError(
+                    "Only {0:n} rows of the result were fetched, so the "
+                    "sorted or filtered rows can't be exported, use "
+                    "\\reset to export all rows".format(len(view.store)))
+            query = self.gateway.execute_async(self.source)
+        progress = _Progress(self._report, "Exported")
+        try:
+            stream = io.open(path, "wb")
+        except EnvironmentError as exc:
+            if query is not None:
+                query.close()
+            raise CommandError("Can't open {0}: {1}".format(path, exc))
+        with stream:
+            writer = get_writer(format, stream)
+            if query is None:
+                rows = self._export(writer, view.keys, iter_batches(
+                    view, self._batch_size), progress)
+            else:
+                rows = self._export_query(
+                    writer, query, view.columns, progress)
+        progress.finish(rows, "to " + path)
+
+    @property
+    def _batch_size(self):
+        if self.gateway is None:
+            return DEFAULT_BATCH_SIZE
+        return self.gateway.batch_size
+
+    def _export(self, writer, keys, batches, progress):
+        "Writes `batches` of rows and returns the number of rows."
+        writer.start_result(keys)
+        rows = 0
+        for batch in batches:
+            writer.write_rows(batch)
+            rows += len(batch)
+            progress(rows)
+        writer.flush()
+        return rows
+
+    def _export_query(self, writer, query, columns, progress):
+        "Writes the `columns` (indexes) of the rows of `query`."
+        try:
+            query.wait_executed()
+            if query.error is not None:
+                raise query.error
+            keys = [query.keys[x] for x in columns]
+            batches = ([tuple(row[x] for x in columns) for row in batch]
+                       for batch in query.iter_batches())
+            return self._export(writer, keys, batches, progress)
+        except KeyboardInterrupt:
+            query.cancel()
+            raise CommandError("Export cancelled after {0:n} rows".format(
+                query.rows_consumed))
+        except (QueryCancelled, sqlalchemy.exc.SQLAlchemyError) as exc:
+            raise CommandError(text_type(exc) or "Export cancelled")
+        finally:
+            query.close()
+
+    def do_import(self, args):
+        """\\import file table: inserts the rows of a CSV file into an
+        existing table, see :func:`~eekhoorn.importer.import_csv`. The
+        import is a single transaction, nothing is imported if it fails.
+        """
+        if self.gateway is None:
+            raise CommandError("There is no database to import into")
+        (path, _, table_name) = args.rpartition(" ")
+        if not path.strip() or not table_name:
+            raise CommandError("Usage: \\import file table")
+        progress = _Progress(self._report, "Imported")
+        try:
+            rows = import_csv(self.gateway, path.strip(), table_name,
+                              progress=progress)
+        except KeyboardInterrupt:
+            raise CommandError("Import cancelled, no rows were imported")
+        except EnvironmentError as exc:
+            raise CommandError("Can't read {0}: {1}".format(path, exc))
+        except (CsvImportError, sqlalchemy.exc.SQLAlchemyError) as exc:
+            raise CommandError(text_type(exc))
+        progress.finish(rows, "into " + table_name)
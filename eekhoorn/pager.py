@@ -2,26 +2,49 @@
 
 from __future__ import unicode_literals
 
+import errno
 import os
 import subprocess
 import sys
-from itertools import chain, islice
-
+from itertools import chain, count
 from colors import green, red
 
+from eekhoorn.result_store import ResultStore
+
 
-def paginate_external(data):
-    """Executes the external pager ($PAGER). Waits until the pager
-    exits. Writes out an error message to ``sys.stderr`` if an
-    ``OSError`` is raised during the operation.
+def paginate_external(lines, encoding):
+    """Executes the external pager ($PAGER) and writes `lines` to its
+    standard input as they are pulled from the iterable, so the pager
+    doesn't have to wait for the whole result. A full pipe blocks
+    pulling more lines and if the pager exits early, no more lines are
+    pulled. Waits until the pager exits. Writes out an error message to
+    ``sys.stderr`` if an ``OSError`` is raised while executing the pager.
     """
     command = os.environ.get('PAGER', 'less').split()
     try:
         pager = subprocess.Popen(command, stdin=subprocess.PIPE)
-        pager.communicate(data)
     except OSError as e:
         msg = "Error executing pager: {0}\n".format(e)
         sys.stderr.write(red(msg))
+        return
+    try:
+        try:
+            for line in lines:
+                pager.stdin.write(line.encode(encoding) + b"\n")
+        finally:
+            pager.stdin.close()
+    except EnvironmentError as e:
+        # The pager was quit before reading everything
+        if e.errno != errno.EPIPE:
+            raise
+    pager.wait()
+
+
+def _write(lines):
+    for line in lines:
+        sys.stdout.write(line)
+        sys.stdout.write("\n")
+    sys.stdout.flush()
 
 
 def _get_key(console):
@@ -34,25 +57,221 @@ def _get_key(console):
         console.restore()
 
 
-def paginate(console, lines):
-    already_printed_lines = []
-    while True:
-        height = console.height - 1
-        for (i, line) in enumerate(islice(lines, height), 1):
-            already_printed_lines.append(line)
-            sys.stdout.write(line)
-            sys.stdout.write("\n")
-        if i < height:
-            break
-        msg = "Press '<space>' for next page or 'p' to open pager"
-        sys.stdout.write(green(msg))
-        sys.stdout.flush()
-        key = _get_key(console)
-        sys.stdout.write("\r" + " " * len(msg) + "\r")
-        sys.stdout.flush()
-        if key == " ":
-            continue
-        elif key == "p":
-            lines = chain(already_printed_lines, lines)
-            paginate_external("\n".join(lines).encode(console.encoding))
-        break
+#: Clears the screen and moves the cursor to the top left corner
+CLEAR_SCREEN = "\x1b[H\x1b[2J"
+
+HELP = ("<space>/b: next/previous page, j/k: next/previous line, "
+        "g/G: start/end, <n>g: row n, p: pager, q: quit")
+#: Added to :data:`HELP` if the columns can be scrolled
+SCROLL_HELP = "h/l: previous/next column, "
+
+
+class ColumnScroller(object):
+    """Scrolls a table that is too wide for the terminal horizontally by
+    rendering it again from another first column.
+
+    `render` is called with the first column, the rows and a
+    `rows_ready` function (see
+    :meth:`eekhoorn.table.Table.render_stream`) and returns the table
+    and its lines. If `store` is given, `rows` is an iterator whose rows
+    are recorded in that :class:`~eekhoorn.result_store.RowStore` as
+    they are pulled and the rows that were already pulled are read from
+    the store again. Otherwise `rows` is iterated again.
+    """
+
+    def __init__(self, render, rows, rows_ready=None, store=None):
+        self._render = render
+        self._rows = rows
+        self._rows_ready = rows_ready
+        self._store = store
+        #: The table that was rendered last
+        self.table = None
+
+    def render(self, first_column):
+        "Returns the lines of the table from `first_column` on."
+        (rows, rows_ready) = (self._rows, self._rows_ready)
+        if self._store is not None and self.table is not None:
+            stored = len(self._store)
+            rows = chain(self._store, rows)
+            # The stored rows are ready, no need to stop sampling early
+            calls = count(1)
+            rows_ready = lambda: (next(calls) < stored or
+                                  self._rows_ready is None or
+                                  self._rows_ready())
+        (self.table, lines) = self._render(first_column, rows, rows_ready)
+        return lines
+
+    def rows_rendered(self):
+        "See :attr:`eekhoorn.table.Table.rows_rendered`."
+        return self.table.rows_rendered
+
+    @property
+    def scrollable(self):
+        "Whether not all columns are visible."
+        table = self.table
+        return table.first_column is not None and (
+            table.first_column > 0 or
+            len(table.visible_columns) < len(table.columns))
+
+    def scroll(self, step):
+        """Renders the table again, scrolled by `step` columns. Returns
+        the lines or `None` if there are no more columns that way.
+        """
+        table = self.table
+        first_column = table.first_column + step
+        last_column = table.first_column + len(table.visible_columns)
+        if first_column < 0 or (
+                step > 0 and last_column >= len(table.columns)):
+            return None
+        return self.render(first_column)
+
+    @property
+    def status(self):
+        "Which columns are visible, e.g. ``columns 1-5 of 12``."
+        table = self.table
+        return "columns {0:n}-{1:n} of {2:n}".format(
+            table.first_column + 1,
+            table.first_column + len(table.visible_columns),
+            len(table.columns))
+
+
+class Pager(object):
+    """The internal pager. The lines are kept in a
+    :class:`~eekhoorn.result_store.ResultStore`, so it can scroll forward
+    and backward and jump to any row using constant memory.
+
+    As long as the user only pages forward, lines are simply printed
+    below the previous page and the terminal scrolls. When moving
+    backward or jumping, the screen is redrawn.
+    """
+
+    def __init__(self, console, store, timings=None, scroller=None):
+        self.console = console
+        self.store = store
+        #: :class:`~eekhoorn.timing.Timings` that the time spent writing
+        #: lines is added to as ``output``, if given
+        self.timings = timings
+        #: :class:`ColumnScroller` to scroll the columns with, if given
+        self.scroller = scroller
+        #: Number of the first and one after the last line on screen
+        self.top = 0
+        self.bottom = 0
+
+    @property
+    def height(self):
+        return self.console.height - 1
+
+    def _write_lines(self, start, end):
+        lines = self.store.get_lines(start, end - start)
+        if self.timings is None:
+            _write(lines)
+        else:
+            with self.timings.measure("output"):
+                _write(lines)
+
+    def show(self, top):
+        "Shows the page starting at line `top`."
+        height = self.height
+        end = self.store.fill(top + height)
+        top = max(0, min(top, end - height))
+        if self.top <= top <= self.bottom and self.bottom <= end:
+            self._write_lines(self.bottom, top + height)
+        else:
+            sys.stdout.write(CLEAR_SCREEN)
+            self._write_lines(top, top + height)
+        self.top = top
+        self.bottom = min(end, top + height)
+
+    def scroll(self, step):
+        """Scrolls the columns by `step` and redraws the screen, keeping
+        the row at the top of the screen.
+        """
+        lines = self.scroller.scroll(step)
+        if lines is None:
+            return
+        row = self.store.row_of_line(self.top)
+        self.store.close()
+        self.store = ResultStore(
+            lines, self.store.encoding, self.scroller.rows_rendered)
+        line = None if row is None else self.store.line_of_row(row)
+        # Force a redraw
+        self.top = self.bottom = -1
+        self.show(line or 0)
+
+    def _get_status(self, number):
+        msg = "Lines {0:n}-{1:n}".format(self.top + 1, self.bottom)
+        if not self.store.complete:
+            msg += " (more)"
+        if self.scroller is not None:
+            msg += ", " + self.scroller.status
+        if number:
+            msg += ", go to row " + number
+        if self.scroller is not None:
+            return msg + " | " + SCROLL_HELP + HELP
+        return msg + " | " + HELP
+
+    @property
+    def at_end(self):
+        "Whether the last line is on screen."
+        return self.store.fill(self.bottom + 1) == self.bottom
+
+    def run(self):
+        self.show(0)
+        if self.at_end and self.scroller is None:
+            return
+        number = ""
+        while True:
+            msg = self._get_status(number)[:self.console.width - 1]
+            sys.stdout.write(green(msg))
+            sys.stdout.flush()
+            key = _get_key(self.console)
+            sys.stdout.write("\r" + " " * len(msg) + "\r")
+            sys.stdout.flush()
+            if len(key) == 1 and key.isdigit():
+                number += key
+                continue
+            if key in (" ", "f", "page down"):
+                if self.at_end:
+                    break
+                self.show(self.top + self.height)
+            elif key in ("b", "page up"):
+                self.show(self.top - self.height)
+            elif key in ("j", "down", "\r", "\n"):
+                self.show(self.top + 1)
+            elif key in ("k", "up"):
+                self.show(self.top - 1)
+            elif key in ("g", "home") and number:
+                line = self.store.line_of_row(int(number) - 1)
+                if line is not None:
+                    self.show(line)
+            elif key in ("g", "home"):
+                self.show(0)
+            elif key in ("G", "end"):
+                self.show(self.store.fill_all())
+            elif key in ("h", "left") and self.scroller is not None:
+                self.scroll(-1)
+            elif key in ("l", "right") and self.scroller is not None:
+                self.scroll(1)
+            elif key == "p":
+                paginate_external(
+                    self.store.iter_lines(store=False), self.console.encoding)
+                break
+            else:
+                break
+            number = ""
+
+
+def paginate(console, lines, rows_rendered=None, timings=None,
+             scroller=None):
+    """Shows `lines` page by page. The lines are pulled from the
+    iterable as they are needed. `rows_rendered` is passed to the
+    :class:`~eekhoorn.result_store.ResultStore` to be able to jump to
+    rows. The time spent writing lines is added to `timings`, if given.
+    If a :class:`ColumnScroller` is given, the columns can be scrolled.
+    """
+    pager = Pager(console, ResultStore(lines, console.encoding, rows_rendered),
+                  timings, scroller)
+    try:
+        pager.run()
+    finally:
+        pager.store.close()
@@ -8,12 +8,18 @@ from six import u
 
 from eekhoorn import highlighting_reader
 from eekhoorn.completion import CompletingReader
+from eekhoorn.meta_commands import is_command
 from eekhoorn.sql import statement_finished
 
 
 class maybe_accept(commands.Command):
     def do(self):
-        self.finish = statement_finished(self.reader.get_unicode())
+        source = self.reader.get_unicode()
+        if is_command(source):
+            self.finish = True
+            return
+        tokens = self.reader.parse_cache.tokenize(source)
+        self.finish = statement_finished(source, tokens)
         if not self.finish:
             self.reader.insert(u("\n"))
 
@@ -24,7 +30,12 @@ class complete(completing_reader.complete):
         if all((c in ["\t", " "]) for c in line):
             reader.insert("\t")
         else:
-            return super(complete, self).do()
+            super(complete, self).do()
+            if reader.gateway.schema_loading:
+                # Completions are based on the tables loaded so far
+                hint = green(u("schema loading\u2026"))
+                reader.msg = u(" ").join(filter(None, [reader.msg, hint]))
+                reader.dirty = True
 
 class maybe_forced_accept(commands.Command):
     """Prints a hint that you can exit using "C-x C-c" or accepts the
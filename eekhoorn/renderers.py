@@ -0,0 +1,179 @@
+# encoding: utf-8
+
+"""
+    Cell renderers for the columns of query results. The renderer of a
+    column is chosen once, either from the column's type as reported by
+    the database driver or from the column's first non-NULL value.
+"""
+
+from __future__ import unicode_literals
+
+import binascii
+import datetime
+import decimal
+from functools import partial
+
+from colors import blue, green, magenta, red, yellow
+from six import PY2, integer_types, text_type
+
+from eekhoorn.table import Cell, DefaultCellRenderer, normalize_whitespace
+
+
+if PY2:
+    BINARY_TYPES = (bytearray, memoryview, buffer)  # noqa
+else:
+    BINARY_TYPES = (bytes, bytearray, memoryview)
+
+NUMERIC_TYPES = integer_types + (float, decimal.Decimal)
+TEMPORAL_TYPES = (
+    datetime.date, datetime.time, datetime.datetime, datetime.timedelta)
+
+
+class ColorCellRenderer(DefaultCellRenderer):
+    "Renders cells like the default renderer, but colors their lines."
+
+    def __init__(self, justification="left", color=None, wrap_words=False):
+        super(ColorCellRenderer, self).__init__(justification, wrap_words)
+        self.color = color
+
+    def render_text(self, text, width):
+        lines = super(ColorCellRenderer, self).render_text(text, width)
+        if self.color is None:
+            return lines
+        return [self.color(line) for line in lines]
+
+
+#: Renders NULL values of every column
+NULL_RENDERER = ColorCellRenderer("right", partial(red, style="italic"))
+NULL_CELL = NULL_RENDERER.prepare("NULL")
+
+
+class ColumnRenderer(ColorCellRenderer):
+    """Base class for renderers of columns with values of a single type.
+    Subclasses set the justification, the color and the `types` of the
+    values they render and may override :meth:`to_text`. Values of
+    other types, which some databases allow in any column, are rendered
+    as plain text.
+    """
+
+    justification = "left"
+    color = None
+    types = (object,)
+
+    def __init__(self):
+        super(ColumnRenderer, self).__init__(self.justification, self.color)
+
+    def prepare(self, value):
+        if value is None:
+            return NULL_CELL
+        elif not isinstance(value, self.types):
+            return PLAIN_RENDERER.prepare(value)
+        text = normalize_whitespace(self.to_text(value))
+        return Cell(text, len(text) + 2, self)
+
+    def to_text(self, value):
+        return text_type(value)
+
+
+class NumericRenderer(ColumnRenderer):
+    justification = "right"
+    color = staticmethod(green)
+    types = NUMERIC_TYPES
+
+
+class TemporalRenderer(ColumnRenderer):
+    color = staticmethod(magenta)
+    types = TEMPORAL_TYPES
+
+    def to_text(self, value):
+        if isinstance(value, datetime.datetime):
+            return value.isoformat(str(" "))
+        return text_type(value)
+
+
+class BooleanRenderer(ColumnRenderer):
+    color = staticmethod(yellow)
+    # Some databases return booleans as integers
+    types = integer_types + (bool,)
+
+    def to_text(self, value):
+        if value is True or value is False:
+            return "true" if value else "false"
+        return text_type(value)
+
+
+class BinaryRenderer(ColumnRenderer):
+    "Renders binary values as hex digits, like PostgreSQL does."
+
+    color = staticmethod(blue)
+    types = BINARY_TYPES
+
+    def to_text(self, value):
+        if isinstance(value, BINARY_TYPES):
+            data = bytes(bytearray(value))
+            return "\\x" + binascii.hexlify(data).decode("ascii")
+        return text_type(value)
+
+
+class TextRenderer(ColumnRenderer):
+    def prepare(self, value):
+        if value is None:
+            return NULL_CELL
+        return DefaultCellRenderer.prepare(self, value)
+
+
+#: Renders values whose type doesn't match their column's renderer
+PLAIN_RENDERER = TextRenderer()
+
+
+class AutoRenderer(object):
+    """Picks the renderer of a column from its first non-NULL value. The
+    choice is only made once, afterwards :meth:`prepare` is the chosen
+    renderer's method.
+    """
+
+    def prepare(self, value):
+        if value is None:
+            return NULL_CELL
+        self.prepare = get_value_renderer(value).prepare
+        return self.prepare(value)
+
+    def estimate_width(self, value):
+        return self.prepare(value).width
+
+
+def get_value_renderer(value):
+    "Returns a renderer for a column that contains `value`."
+    # bool is a subclass of int, so check it first
+    if isinstance(value, bool):
+        return BooleanRenderer()
+    elif isinstance(value, NUMERIC_TYPES):
+        return NumericRenderer()
+    elif isinstance(value, TEMPORAL_TYPES):
+        return TemporalRenderer()
+    elif isinstance(value, BINARY_TYPES):
+        return BinaryRenderer()
+    return TextRenderer()
+
+
+#: DB-API 2.0 type objects and the renderers of matching columns
+_TYPE_OBJECTS = [
+    ("BINARY", BinaryRenderer),
+    ("NUMBER", NumericRenderer),
+    ("DATETIME", TemporalRenderer),
+    ("STRING", TextRenderer),
+]
+
+
+def get_column_renderer(type_code, dbapi=None):
+    """Returns a renderer for a column with the DB-API `type_code` (the
+    second item of the column's entry in ``cursor.description``). If the
+    type code doesn't tell, the renderer is picked from the column's
+    first non-NULL value.
+    """
+    if type_code is not None and dbapi is not None:
+        for (name, renderer_class) in _TYPE_OBJECTS:
+            type_object = getattr(dbapi, name, None)
+            if type_object is not None and type_code == type_object:
+                return renderer_class()
+    return AutoRenderer()
@@ -0,0 +1,320 @@
+# encoding: utf-8
+
+"""
+    On-disk stores for results and their rendered lines.
+"""
+
+from __future__ import unicode_literals
+
+import mmap
+import struct
+import tempfile
+from array import array
+
+from six import text_type
+from six.moves import cPickle as pickle
+from six.moves import xrange
+
+
+class _AppendOnlyFile(object):
+    """A temporary file that is appended to and read through a memory
+    map. The map is renewed when data beyond its end is requested.
+    """
+
+    def __init__(self):
+        self._file = tempfile.TemporaryFile()
+        self._size = 0
+        self._map = None
+
+    def __len__(self):
+        return self._size
+
+    def append(self, data):
+        self._file.write(data)
+        self._size += len(data)
+
+    def read(self, start, end):
+        if self._map is None or len(self._map) < end:
+            self._file.flush()
+            if self._map is not None:
+                self._map.close()
+            self._map = mmap.mmap(
+                self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._map[start:end]
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+
+class ResultStore(object):
+    """Stores the lines of a rendered result in temporary files, so
+    that they can be read again in any order without keeping them in
+    memory. The lines are encoded with `encoding` and stored back to
+    back, the offset of each line is stored in an index file.
+
+    Lines are pulled from the iterable `lines` on demand. If given,
+    `rows_rendered` is called after each line and should return the
+    number of rows whose lines were returned so far, see
+    :attr:`eekhoorn.table.Table.rows_rendered`. It's used to find the
+    line of a row.
+
+    Memory use is constant, no matter how many lines there are.
+    """
+
+    #: Format of the index entries (end offset of each line)
+    OFFSET = struct.Struct(str("<Q"))
+
+    def __init__(self, lines, encoding="utf-8", rows_rendered=None):
+        self.encoding = encoding
+        self._lines = iter(lines)
+        self._rows_rendered = rows_rendered
+        self._data = _AppendOnlyFile()
+        self._index = _AppendOnlyFile()
+        #: Number of the first line of every row
+        self._row_index = _AppendOnlyFile()
+        self._rows = 0
+        self.complete = False
+
+    def __len__(self):
+        "Number of lines stored so far."
+        return len(self._index) // self.OFFSET.size
+
+    @property
+    def rows(self):
+        "Number of rows stored so far."
+        return self._rows
+
+    def _pull(self):
+        try:
+            line = next(self._lines)
+        except StopIteration:
+            self.complete = True
+            return False
+        line_number = len(self)
+        self._data.append(line.encode(self.encoding))
+        self._index.append(self.OFFSET.pack(len(self._data)))
+        if self._rows_rendered is not None:
+            rows = self._rows_rendered()
+            while self._rows < rows:
+                self._row_index.append(self.OFFSET.pack(line_number))
+                self._rows += 1
+        return True
+
+    def fill(self, count):
+        """Pulls lines until at least `count` lines are stored or all
+        lines were pulled. Returns the number of lines stored.
+        """
+        while len(self) < count and not self.complete:
+            self._pull()
+        return len(self)
+
+    def fill_all(self):
+        "Pulls all remaining lines."
+        while self._pull():
+            pass
+        return len(self)
+
+    def _read_offset(self, store, index):
+        start = index * self.OFFSET.size
+        data = store.read(start, start + self.OFFSET.size)
+        return self.OFFSET.unpack(data)[0]
+
+    def get_line(self, index):
+        "Returns line number `index`, which has to be stored already."
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        start = self._read_offset(self._index, index - 1) if index else 0
+        end = self._read_offset(self._index, index)
+        return self._data.read(start, end).decode(self.encoding)
+
+    def get_lines(self, start, count):
+        """Returns up to `count` lines starting at line `start`, pulling
+        lines as needed.
+        """
+        end = min(self.fill(start + count), start + count)
+        return [self.get_line(i) for i in xrange(max(0, start), end)]
+
+    def line_of_row(self, row):
+        """Returns the number of the first line of row `row` (counting
+        from 0) or `None` if there is no such row. Pulls lines until
+        the row was rendered.
+        """
+        while self._rows <= row and self._pull():
+            pass
+        if not 0 <= row < self._rows:
+            return None
+        return self._read_offset(self._row_index, row)
+
+    def row_of_line(self, line):
+        """Returns the number of the row that line `line` belongs to or
+        `None` if it's not part of a row (e.g. the header).
+        """
+        (low, high) = (0, self._rows)
+        # Binary search over the on-disk row index
+        while low < high:
+            middle = (low + high) // 2
+            if self._read_offset(self._row_index, middle) <= line:
+                low = middle + 1
+            else:
+                high = middle
+        return low - 1 if low else None
+
+    def iter_lines(self, store=True):
+        """Iterates over all lines, including the ones not pulled yet. If
+        `store` is false, those are passed through without being stored.
+        """
+        index = 0
+        while index < self.fill(index + 1 if store else 0):
+            yield self.get_line(index)
+            index += 1
+        if not store:
+            for line in self._lines:
+                yield line
+            self.complete = True
+
+    def close(self):
+        "Removes the temporary files."
+        self._data.close()
+        self._index.close()
+        self._row_index.close()
+
+
+class RowStore(object):
+    """Stores the rows of a result in temporary files, so that they can
+    be sorted, filtered and rendered again without another query. The
+    rows are pickled back to back, their offsets are stored in an index
+    file like the lines of a :class:`ResultStore`.
+
+    Values that can't be pickled are stored as text.
+    """
+
+    OFFSET = ResultStore.OFFSET
+
+    def __init__(self, keys, type_codes=()):
+        self.keys = list(keys)
+        self.type_codes = list(type_codes)
+        #: Whether all rows of the result were stored
+        self.complete = False
+        self._data = _AppendOnlyFile()
+        self._index = _AppendOnlyFile()
+
+    def __len__(self):
+        return len(self._index) // self.OFFSET.size
+
+    def append(self, row):
+        row = tuple(row)
+        try:
+            data = pickle.dumps(row, pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            data = pickle.dumps(
+                tuple(v if v is None else text_type(v) for v in row),
+                pickle.HIGHEST_PROTOCOL)
+        self._data.append(data)
+        self._index.append(self.OFFSET.pack(len(self._data)))
+
+    def record(self, rows):
+        """Iterates over `rows`, storing each row. If all rows were
+        consumed, the store is marked complete.
+        """
+        for row in rows:
+            self.append(row)
+            yield row
+        self.complete = True
+
+    def _read_offset(self, index):
+        start = index * self.OFFSET.size
+        data = self._index.read(start, start + self.OFFSET.size)
+        return self.OFFSET.unpack(data)[0]
+
+    def __getitem__(self, index):
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        start = self._read_offset(index - 1) if index else 0
+        return pickle.loads(self._data.read(start, self._read_offset(index)))
+
+    def __iter__(self):
+        for index in xrange(len(self)):
+            yield self[index]
+
+    def close(self):
+        "Removes the temporary files."
+        self._data.close()
+        self._index.close()
+
+
+class ResultView(object):
+    """A sorted, filtered or projected view of the rows of a
+    :class:`RowStore`. Views are immutable, the methods return new
+    views. The selected rows are kept as an array of row numbers, the
+    rows themselves stay on disk.
+    """
+
+    def __init__(self, store, indexes=None, columns=None):
+        self.store = store
+        #: Numbers of the selected rows in their order or `None` for all
+        self.indexes = indexes
+        #: Indexes of the selected columns in their order
+        if columns is None:
+            columns = list(xrange(len(store.keys)))
+        self.columns = columns
+
+    @property
+    def keys(self):
+        return [self.store.keys[x] for x in self.columns]
+
+    @property
+    def type_codes(self):
+        if not self.store.type_codes:
+            return []
+        return [self.store.type_codes[x] for x in self.columns]
+
+    def __len__(self):
+        return len(self.store) if self.indexes is None else len(self.indexes)
+
+    def _iter_full_rows(self):
+        "Iterates over (row number, full row) of the selected rows."
+        if self.indexes is None:
+            return enumerate(self.store)
+        return ((i, self.store[i]) for i in self.indexes)
+
+    def __iter__(self):
+        columns = self.columns
+        for (_, row) in self._iter_full_rows():
+            yield tuple(row[x] for x in columns)
+
+    def column_index(self, name):
+        "Returns the index of the column `name`, raises `KeyError`."
+        try:
+            return self.store.keys.index(name)
+        except ValueError:
+            raise KeyError(name)
+
+    def sorted(self, name, reverse=False):
+        """Returns a view sorted by column `name`. NULLs come first (last
+        if `reverse` is true). Only the sort keys are loaded into memory.
+        """
+        x = self.column_index(name)
+        keys = [(row[x] is not None, 0 if row[x] is None else row[x], i)
+                for (i, row) in self._iter_full_rows()]
+        try:
+            keys.sort(reverse=reverse)
+        except TypeError:
+            # Values of different types, e.g. in SQLite
+            keys = [(key[0], text_type(key[1]), key[2]) for key in keys]
+            keys.sort(reverse=reverse)
+        indexes = array(str("L"), (key[2] for key in keys))
+        return ResultView(self.store, indexes, self.columns)
+
+    def filtered(self, predicate):
+        "Returns a view of the rows for which `predicate(row)` is true."
+        indexes = array(str("L"), (
+            i for (i, row) in self._iter_full_rows() if predicate(row)))
+        return ResultView(self.store, indexes, self.columns)
+
+    def projected(self, names):
+        "Returns a view with only the columns `names`, in that order."
+        columns = [self.column_index(name) for name in names]
+        return ResultView(self.store, self.indexes, columns)
@@ -0,0 +1,106 @@
+# encoding: utf-8
+
+"""
+    On-disk cache for reflected schemas.
+"""
+
+from __future__ import unicode_literals
+
+import hashlib
+import io
+import json
+import os
+import zlib
+
+import sqlalchemy.exc
+from six import text_type
+
+
+#: Queries that return a cheap fingerprint of the schema, per dialect.
+#: The fingerprint changes whenever a table or column is added, removed,
+#: renamed or altered. On MySQL the hashes of the columns are summed up,
+#: as GROUP_CONCAT truncates its result to group_concat_max_len.
+FINGERPRINT_QUERIES = {
+    "sqlite": (
+        "SELECT type, name, tbl_name, sql FROM sqlite_master "
+        "ORDER BY type, name"),
+    "postgresql": (
+        "SELECT md5(string_agg("
+        "table_name || '.' || column_name || ':' || data_type, ',' "
+        "ORDER BY table_name, ordinal_position)) "
+        "FROM information_schema.columns "
+        "WHERE table_schema = current_schema()"),
+    "mysql": (
+        "SELECT COUNT(*), SUM(CAST(CONV(LEFT(MD5(CONCAT_WS(',', "
+        "table_name, column_name, ordinal_position, column_type)), 15), "
+        "16, 10) AS UNSIGNED)) "
+        "FROM information_schema.columns "
+        "WHERE table_schema = DATABASE()"),
+}
+
+
+def get_schema_fingerprint(engine):
+    """Returns a fingerprint of `engine`'s schema or `None` if the
+    dialect isn't supported.
+    """
+    query = FINGERPRINT_QUERIES.get(engine.dialect.name)
+    if query is None:
+        return None
+    try:
+        rows = engine.execute(query).fetchall()
+    except sqlalchemy.exc.SQLAlchemyError:
+        return None
+    data = repr([tuple(text_type(value) for value in row) for row in rows])
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+
+def get_default_cache_dir():
+    "Returns the directory where schema caches are stored by default."
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base, "eekhoorn")
+
+
+class SchemaCache(object):
+    """Stores table and column names in compressed files, one per
+    engine URL. A cached schema is only returned if its fingerprint
+    matches the current one.
+    """
+
+    def __init__(self, directory=None):
+        if directory is None:
+            directory = get_default_cache_dir()
+        self.directory = directory
+
+    def _get_path(self, url):
+        key = hashlib.sha1(text_type(url).encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, key + ".json.z")
+
+    def load(self, url, fingerprint):
+        """Returns the cached schema as mapping table name => list of
+        column names or `None` if there is no valid cache entry.
+        """
+        try:
+            with io.open(self._get_path(url), "rb") as cache_file:
+                data = json.loads(
+                    zlib.decompress(cache_file.read()).decode("utf-8"))
+        except (EnvironmentError, ValueError, zlib.error):
+            return None
+        if data.get("fingerprint") != fingerprint:
+            return None
+        return data.get("tables")
+
+    def save(self, url, fingerprint, tables):
+        """Stores `tables` (a mapping table name => list of column
+        names). Errors are ignored, the cache is just an optimization.
+        """
+        data = json.dumps({"fingerprint": fingerprint, "tables": tables})
+        path = self._get_path(url)
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            temp_path = path + ".tmp"
+            with io.open(temp_path, "wb") as cache_file:
+                cache_file.write(zlib.compress(data.encode("utf-8")))
+            os.rename(temp_path, path)
+        except EnvironmentError:
+            pass
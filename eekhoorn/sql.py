@@ -1,14 +1,20 @@
 # encoding: utf-8
 
+from bisect import bisect_left, bisect_right
 from itertools import chain
 
 import sqlparse
 from six import u
-from sqlparse import sql
+from six.moves import xrange
+from sqlparse import lexer, sql
 from sqlparse.tokens import Token
 
 
 _whitespace = set([Token.Text, Token.Text.Whitespace])
+# Tokens that can end a line
+_line_ends = (Token.Text.Whitespace.Newline, Token.Comment.Single)
+# Tokens that still belong to a statement after its final ";"
+_trailing = (Token.Text.Whitespace, Token.Comment.Single)
 
 def get_tokens(source):
     """Returns a list of all tokens, not separated by statement. All
@@ -36,10 +42,14 @@ def _skip_ws(tokens_iter):
             return token
     return None
 
-def statement_finished(source):
+def statement_finished(source, tokens=None):
     """Returns whether the given source contains a finished (i.e. ending
-    with a ':') SQL statement."""
-    token_iter = reversed(list(flatten(get_tokens(source))))
+    with a ':') SQL statement. `tokens` are the tokens of `source` as
+    returned by :func:`tokenize` or :func:`get_tokens`, if already
+    known."""
+    if tokens is None:
+        tokens = tokenize(source)
+    token_iter = reversed(list(flatten(tokens)))
     for token in token_iter:
         if token.ttype == Token.Punctuation and token.value == u(";"):
             # Seems like the statement is finished, but there is still
@@ -53,3 +63,395 @@ def statement_finished(source):
         elif token.ttype not in _whitespace:
             break
     return False
+
+
+def _common_prefix_length(a, b):
+    "Returns the length of the common prefix of the strings `a` and `b`."
+    (low, high) = (0, min(len(a), len(b)))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[low:middle] == b[low:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+def _common_suffix_length(a, b, max_length):
+    """Returns the length of the common suffix of the strings `a` and
+    `b`, but at most `max_length`.
+    """
+    (low, high) = (0, max_length)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[len(a) - middle:len(a) - low] == b[len(b) - middle:len(b) - low]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+def _is_restart_point(tokens, index):
+    """Returns whether lexing can be restarted right after the token at
+    `index` of `tokens`. That is the case after a line break outside of
+    comments and literals, as the lexer is always in its root state then
+    and no pattern looks behind a line break. Only keywords of several
+    words (e.g. ``GROUP BY`` in sqlparse 0.2 and newer) can continue on
+    the next line, so a line ending with a keyword doesn't count.
+    """
+    token = tokens[index]
+    if token.ttype not in _line_ends or not token.value.endswith(u("\n")):
+        return False
+    elif token.ttype is not Token.Text.Whitespace.Newline:
+        return True
+    for index in xrange(index - 1, -1, -1):
+        ttype = tokens[index].ttype
+        if ttype not in Token.Text:
+            return not (ttype in Token.Keyword or ttype in Token.Name.Builtin)
+    return True
+
+def _is_unclosed(token):
+    """Returns whether `token` opens a literal without closing it. Text
+    added anywhere after such a token might close the literal. How
+    unclosed literals are lexed differs between sqlparse versions.
+    """
+    if token.ttype is Token.Error:
+        return token.value in (
+            u("'"), u('"'), u("\N{ACUTE ACCENT}"), u("`"), u("$"))
+    elif token.ttype is Token.Operator:
+        return u("`") in token.value
+    return token.ttype is Token.Punctuation and token.value == u("[")
+
+def _opens_comment(previous, token):
+    """Returns whether `previous` and `token` are the start of a comment
+    that is never closed, which sqlparse 0.2 and newer lex as "/" and
+    "*" instead of a comment.
+    """
+    return (previous.ttype is Token.Operator and previous.value == u("/")
+            and token.value.startswith(u("*")))
+
+
+#: State of :func:`_change_splitlevel` at the start of a statement:
+#: whether in a DECLARE section, whether in a $$ quoted body, whether
+#: the statement is a CREATE statement and the depth of BEGIN blocks
+_SPLIT_START = (False, False, False, 0)
+
+def _change_splitlevel(state, ttype, value):
+    """Returns by how much a token changes the nesting level of blocks
+    that a ";" doesn't end a statement in, and the new state. The
+    blocks are tracked like sqlparse's statement splitter does.
+    """
+    (in_declare, in_dbldollar, is_create, begin_depth) = state
+    # PostgreSQL
+    if (ttype is Token.Name.Builtin
+            and value.startswith(u("$")) and value.endswith(u("$"))):
+        delta = -1 if in_dbldollar else 1
+        return (delta, (in_declare, not in_dbldollar, is_create, begin_depth))
+    elif in_dbldollar or ttype not in Token.Keyword:
+        return (0, state)
+    unified = value.upper()
+    if unified == u("DECLARE") and is_create and begin_depth == 0:
+        return (1, (True, in_dbldollar, is_create, begin_depth))
+    elif unified == u("BEGIN"):
+        delta = 1 if in_declare or is_create else 0
+        return (delta, (in_declare, in_dbldollar, is_create, begin_depth + 1))
+    elif unified in (u("END IF"), u("END FOR")):
+        return (-1, state)
+    elif unified == u("END"):
+        # Also ends CASE ... END, like in sqlparse
+        return (-1, (in_declare, in_dbldollar, is_create,
+                     max(0, begin_depth - 1)))
+    elif ttype is Token.Keyword.DDL and unified.startswith(u("CREATE")):
+        return (0, (in_declare, in_dbldollar, True, begin_depth))
+    elif unified in (u("IF"), u("FOR")) and is_create and begin_depth > 0:
+        return (1, state)
+    return (0, state)
+
+
+class IncrementalTokenizer(object):
+    """Tokenizes a source that changes between calls, like the buffer of
+    a reader. Only the part of the source around the edit is lexed
+    again, until the lexer reaches a state it already had before the
+    edit. From there on, the previous tokens are reused.
+
+    Like :func:`get_tokens`, all tokens not belonging to the first
+    statement are returned as error tokens. Unlike :func:`get_tokens`,
+    the tokens are not grouped.
+    """
+
+    def __init__(self):
+        self._source = u("")
+        self._tokens = []
+        #: Offset of each token in the source
+        self._offsets = []
+        #: Indexes of tokens opening a literal that is never closed
+        self._unclosed = []
+        #: State of the statement splitter before each token, up to and
+        #: including the first token of the second statement
+        self._split_states = [(0, False, _SPLIT_START)]
+
+    def tokenize(self, source):
+        "Returns a list of tokens for `source`."
+        if source != self._source:
+            self._update(source)
+        first_end = len(self._split_states) - 1
+        if first_end == len(self._tokens):
+            retval = list(self._tokens)
+        else:
+            retval = self._tokens[:first_end]
+            retval.extend(
+                sql.Token(Token.Error.Next, t.value)
+                for t in self._tokens[first_end:])
+        if not retval:
+            retval.append(sql.Token(Token.Text, u("")))
+        return retval
+
+    def split_first(self, source):
+        """Returns the tokens of the first statement of `source` and the
+        offset at which the rest of `source` starts, or `None` if the
+        first statement isn't finished by a ";" yet. The statement
+        includes its ";" and the whitespace and comment following it.
+        """
+        if source != self._source:
+            self._update(source)
+        (_, finished, _) = self._split_states[-1]
+        end = len(self._split_states) - 1
+        if not finished or any(i < end for i in self._unclosed):
+            # The ";" might be part of a literal that is closed later
+            return None
+        offset = self._offsets[end] if end < len(self._tokens) else len(source)
+        return (self._tokens[:end], offset)
+
+    @property
+    def unclosed(self):
+        """Indexes of the tokens returned by the last call to
+        :meth:`tokenize` that open a literal that is never closed.
+        """
+        return list(self._unclosed)
+
+    def _update(self, source):
+        (old_source, old_tokens, old_offsets) = (
+            self._source, self._tokens, self._offsets)
+        prefix = _common_prefix_length(old_source, source)
+        suffix = _common_suffix_length(
+            old_source, source, min(len(old_source), len(source)) - prefix)
+        # End of the changed region in the new source
+        edit_end = len(source) - suffix
+        delta = len(source) - len(old_source)
+
+        # Find the start of a line before the edit to restart lexing
+        # from. An unclosed literal before the edit might get closed by
+        # it, so lexing has to start before that literal
+        restart = max(0, bisect_right(old_offsets, prefix) - 1)
+        if self._unclosed and self._unclosed[0] < restart:
+            restart = self._unclosed[0]
+        while restart > 0 and not _is_restart_point(old_tokens, restart - 1):
+            restart -= 1
+        offset = old_offsets[restart] if restart < len(old_offsets) else 0
+        # The lists are updated in place, so that adding text at the end
+        # of a long source doesn't copy all of its tokens. Only the old
+        # tokens from the restart point on are kept aside
+        (tail_tokens, tail_offsets) = (
+            old_tokens[restart:], old_offsets[restart:])
+        del old_tokens[restart:]
+        del old_offsets[restart:]
+        (tokens, offsets) = (old_tokens, old_offsets)
+        unclosed = [i for i in self._unclosed if i < restart]
+        resync = None
+        stream = lexer.tokenize(source[offset:])
+        for (ttype, value) in stream:
+            if (offset >= edit_end and tokens
+                    and _is_restart_point(tokens, len(tokens) - 1)):
+                tail_index = bisect_left(tail_offsets, offset - delta)
+                if (tail_index < len(tail_offsets)
+                        and tail_offsets[tail_index] == offset - delta
+                        and (tail_index == 0 or _is_restart_point(
+                            tail_tokens, tail_index - 1))):
+                    # Lexing the rest again would yield the old tokens
+                    old_index = restart + tail_index
+                    resync = (len(tokens), old_index)
+                    shift = len(tokens) - old_index
+                    tokens.extend(tail_tokens[tail_index:])
+                    offsets.extend(
+                        o + delta for o in tail_offsets[tail_index:])
+                    unclosed.extend(
+                        i + shift for i in self._unclosed if i >= old_index)
+                    break
+            token = sql.Token(ttype, value)
+            if _is_unclosed(token):
+                unclosed.append(len(tokens))
+            elif tokens and _opens_comment(tokens[-1], token):
+                unclosed.append(len(tokens) - 1)
+            tokens.append(token)
+            offsets.append(offset)
+            offset += len(value)
+
+        self._source = source
+        self._tokens = tokens
+        self._offsets = offsets
+        self._unclosed = unclosed
+        self._update_split_states(restart, resync)
+
+    def _update_split_states(self, start, resync):
+        """Runs the statement splitter over the tokens from index `start`
+        on until the first statement ends. If the splitter reaches the
+        reused tokens in the same state as before, the previous result
+        is reused.
+        """
+        states = self._split_states
+        if start >= len(states):
+            # The edit happened after the end of the first statement
+            return
+        # Updated in place like the tokens, see :meth:`_update`
+        tail_states = states[start:]
+        del states[start:]
+        (splitlevel, consume_ws, filter_state) = tail_states[0]
+        for index in xrange(start, len(self._tokens)):
+            state = (splitlevel, consume_ws, filter_state)
+            if resync is not None and index >= resync[0]:
+                tail_index = index - resync[0] + resync[1] - start
+                if (0 <= tail_index < len(tail_states)
+                        and tail_states[tail_index] == state):
+                    states.extend(tail_states[tail_index:])
+                    break
+            states.append(state)
+            token = self._tokens[index]
+            if consume_ws and token.ttype not in _trailing:
+                break
+            (delta, filter_state) = _change_splitlevel(
+                filter_state, token.ttype, token.value)
+            splitlevel += delta
+            if (splitlevel <= 0 and token.ttype is Token.Punctuation
+                    and token.value == u(";")):
+                consume_ws = True
+        else:
+            states.append((splitlevel, consume_ws, filter_state))
+        self._split_states = states
+
+
+def tokenize(source):
+    """Like :func:`get_tokens`, but only runs the lexer and doesn't group
+    the tokens, which is a lot cheaper. Sufficient for everything that
+    only needs token types.
+    """
+    return IncrementalTokenizer().tokenize(source)
+
+
+def _is_blank(tokens):
+    "Returns whether `tokens` contain nothing but whitespace and comments."
+    for token in tokens:
+        if token.ttype in Token.Text or token.ttype in Token.Comment:
+            continue
+        elif token.ttype is Token.Punctuation and token.value == u(";"):
+            continue
+        return False
+    return True
+
+#: What statements starting with these words do to the transaction
+_TRANSACTION_CONTROL = {
+    "BEGIN": "begin", "START": "begin", "COMMIT": "commit", "END": "commit",
+    "ROLLBACK": "rollback", "ABORT": "rollback"}
+#: Words that may follow BEGIN if it starts a transaction (and not e.g.
+#: a procedural block)
+_BEGIN_OPTIONS = set([
+    "WORK", "TRANSACTION", "DEFERRED", "IMMEDIATE", "EXCLUSIVE",
+    "ISOLATION", "READ", "NOT", ";"])
+
+def get_transaction_control(statement):
+    """Returns ``"begin"``, ``"commit"`` or ``"rollback"`` if `statement`
+    starts, commits or rolls back a transaction, otherwise `None`.
+    Rolling back to a savepoint doesn't end the transaction.
+    """
+    words = [token.value.upper() for token in tokenize(statement)
+             if token.ttype not in Token.Text
+             and token.ttype not in Token.Comment][:3]
+    control = _TRANSACTION_CONTROL.get(words[0]) if words else None
+    if words[:1] == ["BEGIN"] and not _BEGIN_OPTIONS.issuperset(words[1:2]):
+        return None
+    if words[:1] == ["START"] and words[1:2] != ["TRANSACTION"]:
+        return None
+    if control == "rollback" and "TO" in words:
+        return None
+    return control
+
+def iter_statements(lines):
+    """Splits the source read from the iterable `lines` into statements
+    and yields them as soon as they are finished, so that the source is
+    never held in memory as a whole. Statements are split like
+    :func:`statement_finished` and :func:`get_tokens` do, the text of
+    the current statement is lexed incrementally, and only when a line
+    with a ";" is added. Empty statements are skipped.
+    """
+    tokenizer = IncrementalTokenizer()
+    pending = []
+    for line in lines:
+        pending.append(line)
+        if u(";") not in line:
+            # Only a ";" can finish a statement
+            continue
+        source = u("").join(pending)
+        while True:
+            split = tokenizer.split_first(source)
+            if split is None:
+                break
+            (tokens, offset) = split
+            if not _is_blank(tokens):
+                yield source[:offset].strip()
+            source = source[offset:]
+        pending = [source]
+    source = u("").join(pending)
+    if not _is_blank(tokenize(source)):
+        # The last statement doesn't need a ";"
+        yield source.strip()
+
+
+class ParseCache(object):
+    """Caches the tokens of a reader's buffer per buffer revision, so
+    that highlighting, completion and accepting a statement share a
+    single parse of each revision. The revision is incremented whenever
+    a different source is passed in.
+    """
+
+    def __init__(self):
+        #: Revision of the buffer, incremented on every change
+        self.revision = 0
+        self.hits = 0
+        self.misses = 0
+        self._source = None
+        self._results = {}
+        self._tokenizer = IncrementalTokenizer()
+
+    def _get(self, kind, source, func):
+        if source != self._source:
+            self._source = source
+            self.revision += 1
+            self._results = {}
+        try:
+            result = self._results[kind]
+        except KeyError:
+            self.misses += 1
+            result = self._results[kind] = func(source)
+        else:
+            self.hits += 1
+        return result
+
+    def get_tokens(self, source):
+        """Returns the grouped tokens of `source`, see :func:`get_tokens`.
+        Only use this if the identifier structure is needed, otherwise
+        use :meth:`tokenize`.
+        """
+        return self._get("parse", source, get_tokens)
+
+    def tokenize(self, source):
+        """Returns the flat tokens of `source`, see
+        :class:`IncrementalTokenizer`.
+        """
+        return self._get("tokenize", source, self._tokenizer.tokenize)
+
+    @property
+    def hit_rate(self):
+        "Fraction of requests answered from the cache."
+        requests = self.hits + self.misses
+        return self.hits / float(requests) if requests else 0.0
+
+    def format_stats(self):
+        msg = u("Parse cache: {0} hits, {1} misses ({2:.1%} hit rate)")
+        return msg.format(self.hits, self.misses, self.hit_rate)
@@ -6,15 +6,37 @@
 
 from __future__ import unicode_literals
 
-from collections import defaultdict
+import math
+import sys
+from array import array
+from collections import namedtuple
+from itertools import chain, islice
 from textwrap import wrap
 
 from six import text_type
 from six.moves import xrange
 
 
+#: A value prepared for rendering: its text, the width it needs
+#: and the renderer that renders the text
+Cell = namedtuple("Cell", "text width renderer")
+
+#: Maps whitespace other than spaces to spaces
+_WHITESPACE = dict((ord(char), " ") for char in "\t\n\x0b\x0c\r")
+
+
+def normalize_whitespace(text):
+    "Replaces line breaks and tabs, which would break the table, by spaces."
+    if "\n" in text or "\t" in text or "\r" in text:
+        return text.translate(_WHITESPACE)
+    return text
+
+
 class DefaultCellRenderer(object):
-    "The default cell renderer."
+    """The default cell renderer. Values that are too long for their
+    column are broken into lines of exactly the column's width, or at
+    word boundaries if `wrap_words` is true.
+    """
 
     JUSTIFIERS = {
         "left": lambda s, w: (" " + s).ljust(w),
@@ -24,26 +46,99 @@ class DefaultCellRenderer(object):
 
     wrap_sign = "\N{LEFTWARDS ARROW WITH HOOK}"
 
-    def __init__(self, justification="left"):
+    def __init__(self, justification="left", wrap_words=False):
         if justification not in self.JUSTIFIERS:
             msg = "Unknown justification: {0!r}"
             raise ValueError(msg.format(justification))
         self.justifier = self.JUSTIFIERS[justification]
+        self.wrap_words = wrap_words
 
     def estimate_width(self, value):
+        return self.prepare(value).width
+
+    def prepare(self, value):
+        """Converts `value` to text and measures it. Returns a
+        :class:`Cell` that is rendered by :meth:`render_text`.
+        """
+        text = normalize_whitespace(text_type(value))
         # 2 ^= Spaces to the left and right
-        return len(text_type(value)) + 2
+        return Cell(text, len(text) + 2, self)
 
     def render(self, value, width):
-        lines = wrap(text_type(value), width - 2)
-        if not lines:
-            lines = [""]
+        return self.render_text(self.prepare(value).text, width)
+
+    def render_text(self, text, width):
+        """Renders the already prepared `text` into a list of lines of
+        `width`.
+        """
+        text_width = max(1, width - 2)
+        if len(text) <= text_width:
+            # Most values fit, no need to wrap them
+            return [self.justifier(text, width)]
+        if self.wrap_words:
+            lines = wrap(text, text_width) or [""]
+        else:
+            lines = [text[i:i + text_width]
+                     for i in xrange(0, len(text), text_width)]
+        last = len(lines) - 1
+        retval = []
         for (i, line) in enumerate(lines):
             line = self.justifier(line, width)
-            if i < (len(lines) - 1):
+            if i < last:
                 # Replace last space with a wrap sign
                 line = line[:-1] + self.wrap_sign
-            yield line
+            retval.append(line)
+        return retval
+
+
+class ColumnCells(object):
+    """The cells of a column. Instead of a :class:`Cell` per row, the
+    texts are kept in a list and the widths in an ``array('I')``. The
+    renderer of each cell is stored as index into the column's distinct
+    renderers, usually there are only one or two of them.
+    """
+
+    def __init__(self):
+        self.texts = []
+        self.widths = array(str("I"))
+        self.renderer_ids = array(str("H"))
+        self.renderers = []
+        self._renderer_ids = {}
+
+    def __len__(self):
+        return len(self.texts)
+
+    def __getitem__(self, index):
+        return Cell(self.texts[index], self.widths[index],
+                    self.renderers[self.renderer_ids[index]])
+
+    def append(self, cell):
+        renderer_id = self._renderer_ids.get(cell.renderer)
+        if renderer_id is None:
+            renderer_id = self._renderer_ids[cell.renderer] = len(
+                self.renderers)
+            self.renderers.append(cell.renderer)
+        self.texts.append(cell.text)
+        self.widths.append(cell.width)
+        self.renderer_ids.append(renderer_id)
+
+    def max_width(self):
+        return max(self.widths) if self.widths else 0
+
+    def width_percentile(self, percentile):
+        """Returns the width that `percentile` percent of the cells don't
+        exceed (0 if there are no cells).
+        """
+        if not self.widths:
+            return 0
+        widths = sorted(self.widths)
+        index = int(math.ceil(len(widths) * percentile / 100.0)) - 1
+        return widths[min(len(widths) - 1, max(0, index))]
+
+
+#: Percentage of a column's cells that should fit into the column when
+#: the table has to be shrunk, see :meth:`Table.recalc_column_widths`
+WIDTH_PERCENTILE = 90
 
 
 class Table(object):
@@ -116,42 +211,110 @@ class Table(object):
         "\N{BOX DRAWINGS LIGHT VERTICAL AND HORIZONTAL}"
     ]
 
-    def __init__(self, columns, max_width=None):
+    def __init__(self, columns, max_width=None, first_column=None,
+                 timings=None):
         self.columns = []
         self.renderers = []
         self.max_width = max_width
+        #: If not `None`, columns aren't shrunk to fit `max_width`, but
+        #: only the columns from this index on that fit are rendered
+        self.first_column = first_column
         self._widths = {}
+        #: Indexes of the columns that are rendered
+        self._visible = []
+        #: The rows' cells, stored per column
+        self._cells = []
+        #: Whether rows were added since the widths were calculated
+        self._measured = True
         for (name, renderer) in columns:
             if renderer is None:
                 renderer = DefaultCellRenderer()
             self.add_column(name, renderer)
             self._widths[name] = len(name) + 2
-        self.row_data = []
+        #: Number of rows whose lines were (at least partly) returned by
+        #: the iterable of the last call to :meth:`render`
+        self.rows_rendered = 0
+        #: :class:`~eekhoorn.timing.Timings` that the time spent measuring
+        #: cells and laying out the columns (``widths``) and preparing and
+        #: rendering rows (``render``) is added to, if given
+        self.timings = timings
 
     def add_column(self, name, renderer):
         """Adds a new column `name` to the table that formats its values using
         the given cell renderer.
         """
+        self._visible.append(len(self.columns))
         self.columns.append(name)
         self.renderers.append(renderer)
+        self._cells.append(ColumnCells())
+
+    def _prepare_row(self, row_data):
+        return [renderer.prepare(value)
+                for (renderer, value) in zip(self.renderers, row_data)]
+
+    def _prepare_visible(self, row_data):
+        "Like :meth:`_prepare_row`, but only for the visible columns."
+        renderers = self.renderers
+        return [renderers[x].prepare(row_data[x]) for x in self._visible]
 
     def add_row(self, row_data):
         """Adds a single row to the table. `row_data` should be an iterable
-        with `six.text_type` values.
+        with `six.text_type` values. The values are converted and
+        measured once and stored per column, see :class:`ColumnCells`.
+        """
+        for (cells, cell) in zip(self._cells, self._prepare_row(row_data)):
+            cells.append(cell)
+        self._measured = False
+
+    @property
+    def row_data(self):
+        "A list of the rows added to the table, as lists of :class:`Cell`."
+        return list(self._iter_rows(self._cells))
+
+    def _iter_rows(self, columns):
+        if not columns:
+            return
+        for i in xrange(len(columns[0])):
+            yield [cells[i] for cells in columns]
+
+    def _measure(self):
+        "Calculates the column widths from the widths of all cells."
+        if self._measured:
+            return
+        for (name, cells) in zip(self.columns, self._cells):
+            self._widths[name] = max(len(name) + 2, cells.max_width())
+        self._measured = True
+
+    def width_percentile(self, name, percentile):
+        """Returns the width that `percentile` percent of the cells of
+        column `name` don't exceed.
         """
-        row = []
-        for (i, (name, value)) in enumerate(zip(self.columns, row_data)):
-            # 2 == one space in front and behind
-            width = self.renderers[i].estimate_width(value)
-            if width > self._widths[name]:
-                self._widths[name] = width
-            row.append(value)
-        self.row_data.append(row)
+        return self._cells[self.columns.index(name)].width_percentile(
+            percentile)
 
     def recalc_column_widths(self):
         """Shrink columns so that the complete table is smaller than
-        `max_width`.
+        `max_width`. Columns are only narrowed as far as needed, down to
+        the width that :data:`WIDTH_PERCENTILE` percent of their cells
+        fit into, so that a few long values are wrapped instead of
+        widening their column. The columns that are widest above that
+        width are narrowed first. If the table is still too wide, the
+        widest columns share the space that is left.
         """
+        excess = self.width - self.max_width
+        room = []
+        for (name, cells) in zip(self.columns, self._cells):
+            narrowest = max(
+                len(name) + 2, cells.width_percentile(WIDTH_PERCENTILE))
+            room.append((self._widths[name] - narrowest, name))
+        for (space, name) in sorted(room, reverse=True):
+            if excess <= 0:
+                return
+            space = min(max(space, 0), excess)
+            self._widths[name] -= space
+            excess -= space
+        if excess <= 0:
+            return
         # max_width - left and right - column separators
         max_width = self.max_width - 2 - max(0, len(self.columns) - 1)
         max_column_width = max_width / len(self.columns)
@@ -171,29 +334,115 @@ class Table(object):
     @property
     def width(self):
         "The table's current width (might change if more rows are added)"
+        self._measure()
         # Assumes all the left and right table decorations as well as
         # the column separators are only one char wide
         return sum(self._widths.values()) + 2 + max(0, len(self.columns) - 1)
 
+    @property
+    def visible_columns(self):
+        "Names of the columns that are rendered."
+        return [self.columns[x] for x in self._visible]
+
+    def _layout(self):
+        """Fixes the width of the columns and which of them are visible
+        before rendering.
+        """
+        self._measure()
+        if self.first_column is None:
+            if self.max_width and self.width > self.max_width:
+                self.recalc_column_widths()
+            self._visible = list(xrange(len(self.columns)))
+        else:
+            self._visible = self._get_viewport()
+
+    def _get_viewport(self):
+        """Returns the indexes of the columns from :attr:`first_column` on
+        that fit into `max_width`, but at least one. A column that is
+        wider than `max_width` on its own is shrunk.
+        """
+        # max_width - left and right
+        max_width = (self.max_width or sys.maxsize) - 2
+        visible = []
+        space_taken = 0
+        for x in xrange(self.first_column, len(self.columns)):
+            name = self.columns[x]
+            self._widths[name] = min(self._widths[name], max_width)
+            # Plus column separator
+            width = self._widths[name] + (1 if visible else 0)
+            if visible and space_taken + width > max_width:
+                break
+            visible.append(x)
+            space_taken += width
+        return visible
+
+    def _iter_visible_rows(self, columns):
+        return self._iter_rows([columns[x] for x in self._visible])
+
+    def _timed(self, phase, func, *args):
+        "Calls `func`, adding the time it takes to `phase` of the timings."
+        if self.timings is None:
+            return func(*args)
+        with self.timings.measure(phase):
+            return func(*args)
+
     def render(self):
         "Returns an iterable of lines."
-        if self.max_width and self.width > self.max_width:
-            self.recalc_column_widths()
+        self._timed("widths", self._layout)
+        return self._render_rows(self._iter_visible_rows(self._cells))
+
+    def render_stream(self, rows, sample_size=100, rows_ready=None):
+        """Returns an iterable of lines for the table's rows followed by
+        all rows of the iterable `rows`. The rows are rendered as they
+        are consumed and are not kept in the table. The column widths
+        are fixed after the first `sample_size` rows, values of later
+        rows that don't fit are wrapped.
+
+        If `rows_ready` is given, it's called after each sampled row and
+        sampling stops early once it returns false, so that the first
+        lines aren't delayed by waiting for more rows.
+        """
+        rows = iter(rows)
+        for row in islice(rows, sample_size):
+            self._timed("widths", self.add_row, row)
+            if rows_ready is not None and not rows_ready():
+                break
+        self._timed("widths", self._layout)
+        sampled_rows = self._iter_visible_rows(self._cells)
+        self._cells = [ColumnCells() for _ in self.columns]
+        if len(self._visible) < len(self.columns):
+            prepare = self._prepare_visible
+        else:
+            prepare = self._prepare_row
+        rows = (self._timed("render", prepare, row) for row in rows)
+        return self._render_rows(chain(sampled_rows, rows))
+
+    def _render_rows(self, rows):
         for line in self.render_header():
             yield line
-        for (i, row) in enumerate(self.row_data):
-            if i > 0:
-                yield self._render_sep_line(*self.line)
-            lines = self.render_row(zip(row, self.renderers), *self.row)
+        self.rows_rendered = 0
+        for (i, row) in enumerate(rows):
+            (sep_line, lines) = self._timed(
+                "render", self._render_row_lines, i, row)
+            if sep_line is not None:
+                yield sep_line
+            self.rows_rendered = i + 1
             for line in lines:
                 yield line
         yield self.render_bottom()
 
+    def _render_row_lines(self, i, row):
+        """Returns the separator line before the `i`-th row (`None` for the
+        first row) and the lines of the row.
+        """
+        sep_line = self._render_sep_line(*self.line) if i > 0 else None
+        return (sep_line, list(self.render_cells(row, *self.row)))
+
     def render_header(self):
         yield self._render_sep_line(*self.header_top)
-        cell_renderer = DefaultCellRenderer("center")
+        cell_renderer = DefaultCellRenderer("center", wrap_words=True)
         cell_renderer.wrap_sign = " "
-        header_row = zip(self.columns, [cell_renderer] * len(self.columns))
+        header_row = [(name, cell_renderer) for name in self.visible_columns]
         lines = self.render_row(header_row, *self.header_middle)
         for line in lines:
             yield line
@@ -206,28 +455,29 @@ class Table(object):
         "Draws a separation line using the given symbols."
         return "".join([
             left,
-            sep.join(middle * self._widths[name] for name in self.columns),
+            sep.join(middle * self._widths[name]
+                     for name in self.visible_columns),
             right])
 
     def render_row(self, row, left, right, sep):
-        # XXX this became a bit messy
-        justified_lines = defaultdict(list)
-        number_of_lines = []
-        iterable = enumerate(zip(self.columns, row))
-        for (x, (name, (value, renderer))) in iterable:
-            width = self._widths[name]
-            for (y, line) in enumerate(renderer.render(value, width)):
-                justified_lines[(x, y)] = line
-            number_of_lines.append(y + 1)
-        if not justified_lines:
+        """Renders an iterable of (value, renderer) pairs, one for each
+        visible column.
+        """
+        cells = [renderer.prepare(value) for (value, renderer) in row]
+        return self.render_cells(cells, left, right, sep)
+
+    def render_cells(self, cells, left, right, sep):
+        "Renders a list of :class:`Cell`, one for each visible column."
+        widths = [self._widths[name] for name in self.visible_columns]
+        columns = []
+        for (width, cell) in zip(widths, cells):
+            columns.append(cell.renderer.render_text(cell.text, width))
+        if not columns:
             return
-        for y in xrange(max(number_of_lines)):
+        for y in xrange(max(len(lines) for lines in columns)):
             values = []
-            for x in xrange(len(self.columns)):
-                value = justified_lines.get((x, y))
-                if value is None:
-                    value = " " * self._widths[self.columns[x]]
-                values.append(value)
+            for (width, lines) in zip(widths, columns):
+                values.append(lines[y] if y < len(lines) else " " * width)
             yield "".join([
                 left,
                 sep.join(values),
@@ -0,0 +1,76 @@
+# encoding: utf-8
+
+from __future__ import unicode_literals
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from eekhoorn.batch import run_batch
+from eekhoorn.gateway import DatabaseGateway
+from eekhoorn.writers import get_writer
+
+
+class RunBatchTest(unittest.TestCase):
+    def setUp(self):
+        self.gateway = DatabaseGateway("sqlite://", batch_size=2)
+        self.output = io.BytesIO()
+        self.errors = io.StringIO()
+
+    def run_script(self, script, format="csv"):
+        writer = get_writer(format, self.output)
+        lines = io.StringIO(script)
+        status = run_batch(self.gateway, lines, writer, self.errors)
+        return (status, self.output.getvalue().decode("utf-8"))
+
+    def test_script(self):
+        (status, output) = self.run_script(
+            "CREATE TABLE spam (id INTEGER);\n"
+            "INSERT INTO spam VALUES (1), (2), (3);\n"
+            "SELECT id FROM spam ORDER BY id;\n"
+            "SELECT count(*) AS n FROM spam\n")
+        self.assertEqual(status, 0)
+        self.assertEqual(output, "id\n1\n2\n3\n\nn\n3\n")
+        self.assertEqual(self.errors.getvalue(), "")
+
+    def test_stops_at_error(self):
+        (status, output) = self.run_script(
+            "SELECT 1 AS a;\nSELECT nope;\nSELECT 2 AS b;", "jsonl")
+        self.assertEqual(status, 1)
+        self.assertEqual(output, '{"a": 1}\n')
+        self.assertTrue(self.errors.getvalue().startswith(
+            "Statement 2 failed:"))
+
+    def use_file(self):
+        # Unlike in-memory databases, each connection is a new session
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.gateway = DatabaseGateway(
+            "sqlite:///" + os.path.join(directory, "test.db"))
+
+    def test_single_session(self):
+        self.use_file()
+        (status, output) = self.run_script(
+            "CREATE TEMP TABLE spam (id INTEGER);\n"
+            "INSERT INTO spam VALUES (1);\n"
+            "SELECT id FROM spam;\n")
+        self.assertEqual(status, 0)
+        self.assertEqual(output, "id\n1\n")
+
+    def test_explicit_transaction(self):
+        self.use_file()
+        (status, output) = self.run_script(
+            "CREATE TABLE spam (id INTEGER);\n"
+            "BEGIN;\n"
+            "INSERT INTO spam VALUES (1);\n"
+            "ROLLBACK;\n"
+            "INSERT INTO spam VALUES (2);\n"
+            "SELECT id FROM spam;\n")
+        self.assertEqual(self.errors.getvalue(), "")
+        self.assertEqual(status, 0)
+        self.assertEqual(output, "id\n2\n")
+        # Statements after the transaction are committed
+        count = self.gateway.execute("SELECT count(*) FROM spam").scalar()
+        self.assertEqual(count, 1)
@@ -5,12 +5,16 @@ try:
 except ImportError:
     import unittest
 
+import sqlalchemy
 import sqlparse
 from pyrepl.reader import make_default_syntax_table
 from six import u
 
 from eekhoorn.completion import (
-    get_all_identifiers,get_completions, get_current_token)
+    CompletionIndex, PrefixIndex, get_all_identifiers,get_completions,
+    get_current_token, get_unique_column_names)
+from eekhoorn.gateway import TableCatalog
+from eekhoorn.sql import ParseCache
 
 
 class TestReader(object):
@@ -21,6 +25,7 @@ class TestReader(object):
         else:
             self.pos = pos
         self.syntax_table = make_default_syntax_table()
+        self.parse_cache = ParseCache()
 
     def get_unicode(self):
         return u("").join(self.buffer)
@@ -118,3 +123,68 @@ class CompletionsTest(unittest.TestCase):
         # Should not crash
         reader = TestReader(u("SELECT * FROM table WHERE ''"))
         get_completions(reader, u(""), TestGateway({}))
+
+
+class UniqueColumnNamesTest(unittest.TestCase):
+    def test_set_operations(self):
+        idents = {u("s"): set([u("spam")]), u("e"): set([u("eggs")]),
+                  u("h"): set([u("ham")]), u("x"): set([u("s.id")])}
+        tables = {
+            u("spam"): TestTable([u("id"), u("spam"), u("name")]),
+            u("eggs"): TestTable([u("id"), u("eggs")]),
+            u("ham"): TestTable([u("name"), u("ham")]),
+        }
+        self.assertEqual(
+            get_unique_column_names(idents, tables),
+            set([u("spam"), u("eggs"), u("ham")]))
+
+    def test_catalog(self):
+        metadata = sqlalchemy.MetaData()
+        tables = TableCatalog([], None)
+        tables.add(sqlalchemy.Table(
+            u("spam"), metadata, sqlalchemy.Column(u("id")),
+            sqlalchemy.Column(u("spam"))))
+        tables.add(sqlalchemy.Table(
+            u("eggs"), metadata, sqlalchemy.Column(u("id"))))
+        # Tables that aren't used don't make columns ambiguous
+        tables.add(sqlalchemy.Table(
+            u("ham"), metadata, sqlalchemy.Column(u("spam"))))
+        idents = {u("spam"): set([u("spam")]), u("eggs"): set([u("eggs")])}
+        self.assertEqual(
+            get_unique_column_names(idents, tables), set([u("spam")]))
+
+
+class PrefixIndexTest(unittest.TestCase):
+    def test_find(self):
+        index = PrefixIndex([u("spam"), u("eggs"), u("spammer"), u("sp")])
+        self.assertEqual(index.find(u("spam")), [u("spam"), u("spammer")])
+        self.assertEqual(index.find(u("x")), [])
+        self.assertEqual(len(index.find(u(""))), 4)
+
+
+class CompletionIndexTest(unittest.TestCase):
+    def test_rebuilt_on_schema_change(self):
+        tables = TableCatalog([u("spam")], None)
+        index = CompletionIndex()
+        self.assertEqual(index.find(tables, u("spa")), [u("spam")])
+        tables.add_names([u("spammer")])
+        self.assertEqual(
+            index.find(tables, u("spa")), [u("spam"), u("spammer")])
+
+    def test_columns(self):
+        tables = {u("spam"): TestTable([u("id"), u("ham"), u("hash")])}
+        index = CompletionIndex()
+        self.assertEqual(
+            index.find_columns(tables, u("spam"), u("ha")),
+            [u("ham"), u("hash")])
+        self.assertEqual(index.find_columns(tables, u("eggs"), u("")), [])
+
+    def test_completions_sorted(self):
+        reader = TestReader(u("SELECT * FROM spam s WHERE "))
+        gateway = TestGateway({u("spam"): TestTable([u("id")])})
+        completions = get_completions(
+            reader, u(""), gateway, CompletionIndex())
+        self.assertEqual(completions, sorted(completions))
+        self.assertIn(u("spam"), completions)
+        self.assertIn(u("SELECT"), completions)
+        self.assertIn(u("id"), completions)
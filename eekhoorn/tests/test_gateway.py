@@ -0,0 +1,308 @@
+# encoding: utf-8
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+import os
+import shutil
+import tempfile
+import time
+from contextlib import closing
+
+import sqlalchemy
+
+from eekhoorn.gateway import (
+    DatabaseGateway, QueryCancelled, TableCatalog, iter_batches)
+from eekhoorn.schema_cache import SchemaCache, get_schema_fingerprint
+
+
+def create_database(path):
+    engine = sqlalchemy.create_engine("sqlite:///" + path)
+    engine.execute("CREATE TABLE spam (id INTEGER, spam TEXT)")
+    engine.execute("CREATE TABLE eggs (id INTEGER, eggs TEXT)")
+    engine.dispose()
+
+
+class GatewayTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        path = os.path.join(self.directory, "test.db")
+        create_database(path)
+        self.url = "sqlite:///" + path
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+
+class LazyReflectionTest(GatewayTestCase):
+    def test_eager(self):
+        gateway = DatabaseGateway(self.url)
+        self.assertEqual(sorted(gateway.tables), ["eggs", "spam"])
+        self.assertTrue(gateway.tables.is_loaded("spam"))
+
+    def test_only_names_loaded(self):
+        gateway = DatabaseGateway(self.url, lazy=True)
+        self.assertEqual(sorted(gateway.tables), ["eggs", "spam"])
+        self.assertIn("spam", gateway.tables)
+        self.assertFalse(gateway.tables.is_loaded("spam"))
+        self.assertEqual(len(gateway.metadata.tables), 0)
+
+    def test_reflect_on_access(self):
+        gateway = DatabaseGateway(self.url, lazy=True)
+        table = gateway.tables.get("spam")
+        self.assertEqual([c.name for c in table.columns], ["id", "spam"])
+        self.assertTrue(gateway.tables.is_loaded("spam"))
+        self.assertFalse(gateway.tables.is_loaded("eggs"))
+        self.assertIs(gateway.tables["spam"], table)
+
+    def test_unknown_table(self):
+        gateway = DatabaseGateway(self.url, lazy=True)
+        self.assertIsNone(gateway.tables.get("unknown"))
+        self.assertEqual(len(gateway.metadata.tables), 0)
+
+    def test_dropped_table(self):
+        gateway = DatabaseGateway(self.url, lazy=True)
+        revision = gateway.tables.revision
+        gateway.execute("DROP TABLE spam")
+        self.assertIsNone(gateway.tables.get("spam"))
+        self.assertNotIn("spam", gateway.tables)
+        self.assertEqual(list(gateway.tables), ["eggs"])
+        self.assertGreater(gateway.tables.revision, revision)
+
+    def test_reflection_error(self):
+        errors = [sqlalchemy.exc.OperationalError("", {}, None)]
+        def reflect(name):
+            if errors:
+                raise errors.pop()
+            return sqlalchemy.Table(name, sqlalchemy.MetaData())
+        catalog = TableCatalog(["spam"], reflect)
+        revision = catalog.revision
+        self.assertIsNone(catalog.get("spam"))
+        # Other errors than a missing table don't remove the name
+        self.assertIn("spam", catalog)
+        self.assertEqual(catalog.revision, revision)
+        self.assertEqual(catalog.get("spam").name, "spam")
+
+
+class ColumnIndexTest(GatewayTestCase):
+    def test_tables_with_column(self):
+        gateway = DatabaseGateway(self.url)
+        self.assertEqual(gateway.tables_with_column("id"),
+                         frozenset(["spam", "eggs"]))
+        self.assertEqual(gateway.tables_with_column("spam"),
+                         frozenset(["spam"]))
+        self.assertEqual(gateway.tables_with_column("ham"), frozenset())
+
+    def test_lazy(self):
+        gateway = DatabaseGateway(self.url, lazy=True)
+        self.assertEqual(gateway.tables_with_column("id"), frozenset())
+        self.assertEqual(gateway.tables.column_names("eggs"),
+                         frozenset(["id", "eggs"]))
+        self.assertEqual(gateway.tables_with_column("id"),
+                         frozenset(["eggs"]))
+
+    def test_reindexed(self):
+        catalog = TableCatalog([], None)
+        metadata = sqlalchemy.MetaData()
+        catalog.add(sqlalchemy.Table(
+            "spam", metadata, sqlalchemy.Column("ham")))
+        catalog.add(sqlalchemy.Table(
+            "spam", sqlalchemy.MetaData(), sqlalchemy.Column("eggs")))
+        self.assertEqual(catalog.tables_with_column("ham"), frozenset())
+        self.assertEqual(catalog.tables_with_column("eggs"),
+                         frozenset(["spam"]))
+        self.assertIsNone(catalog.column_names("unknown"))
+
+
+class ExecuteTest(GatewayTestCase):
+    def test_stream(self):
+        gateway = DatabaseGateway(self.url)
+        result = gateway.execute("SELECT * FROM spam", stream=True)
+        options = result.context.execution_options
+        self.assertTrue(options.get("stream_results"))
+
+    def test_fetch_rows_in_batches(self):
+        gateway = DatabaseGateway(self.url, batch_size=2)
+        for i in range(5):
+            gateway.execute("INSERT INTO spam VALUES ({0}, 'x')".format(i))
+        result = gateway.execute("SELECT id FROM spam ORDER BY id")
+        batch_sizes = []
+        fetchmany = result.fetchmany
+        def counting_fetchmany(size):
+            rows = fetchmany(size)
+            batch_sizes.append(len(rows))
+            return rows
+        result.fetchmany = counting_fetchmany
+        ids = [row[0] for row in gateway.fetch_rows(result)]
+        self.assertEqual(ids, list(range(5)))
+        self.assertEqual(batch_sizes, [2, 2, 1, 0])
+
+    def test_iter_batches(self):
+        self.assertEqual(list(iter_batches(range(5), 2)),
+                         [[0, 1], [2, 3], [4]])
+        self.assertEqual(list(iter_batches([], 2)), [])
+
+
+class AsyncExecuteTest(GatewayTestCase):
+    endless_query = (
+        "WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c) "
+        "SELECT count(*) FROM c")
+
+    def test_rows(self):
+        gateway = DatabaseGateway(self.url, batch_size=2)
+        for i in range(5):
+            gateway.execute("INSERT INTO spam VALUES ({0}, 'x')".format(i))
+        query = gateway.execute_async("SELECT id FROM spam ORDER BY id")
+        self.assertTrue(query.wait_executed(5))
+        self.assertTrue(query.returns_rows)
+        self.assertEqual(list(query.keys), ["id"])
+        self.assertEqual([row[0] for row in query.iter_rows()], list(range(5)))
+        self.assertEqual(query.rows_fetched, 5)
+        self.assertLessEqual(query.execute_time, query.time_to_first_row)
+        self.assertGreaterEqual(query.fetch_time, 0)
+
+    def test_first_batch(self):
+        gateway = DatabaseGateway(self.url, batch_size=3)
+        for i in range(5):
+            gateway.execute("INSERT INTO spam VALUES ({0}, 'x')".format(i))
+        query = gateway.execute_async("SELECT id FROM spam", first_batch_size=1)
+        rows = query.iter_rows()
+        next(rows)
+        self.assertIsNotNone(query.time_to_first_row)
+        self.assertEqual(query.rows_consumed, 1)
+        self.assertEqual(len(list(rows)), 4)
+        self.assertEqual(query.rows_buffered, 0)
+
+    def test_batches(self):
+        gateway = DatabaseGateway(self.url, batch_size=2)
+        for i in range(5):
+            gateway.execute("INSERT INTO spam VALUES ({0}, 'x')".format(i))
+        query = gateway.execute_async("SELECT id FROM spam ORDER BY id")
+        batches = [[row[0] for row in rows] for rows in query.iter_batches()]
+        self.assertEqual(batches, [[0, 1], [2, 3], [4]])
+        self.assertEqual(query.rows_consumed, 5)
+
+    def test_rowcount(self):
+        gateway = DatabaseGateway(self.url)
+        query = gateway.execute_async("INSERT INTO spam VALUES (1, 'x')")
+        self.assertEqual(list(query.iter_rows()), [])
+        self.assertFalse(query.returns_rows)
+        self.assertEqual(query.rowcount, 1)
+
+    def test_error(self):
+        gateway = DatabaseGateway(self.url)
+        query = gateway.execute_async("SELECT * FROM unknown")
+        with self.assertRaises(sqlalchemy.exc.OperationalError):
+            list(query.iter_rows())
+
+    def test_cancel(self):
+        gateway = DatabaseGateway(self.url)
+        query = gateway.execute_async(self.endless_query)
+        self.assertFalse(query.wait_executed(0.2))
+        start = time.time()
+        query.cancel()
+        with self.assertRaises(QueryCancelled):
+            list(query.iter_rows())
+        query.join(5)
+        self.assertLess(time.time() - start, 5)
+        self.assertIsInstance(query.error, sqlalchemy.exc.OperationalError)
+        # The connection can be used again
+        self.assertEqual(gateway.execute("SELECT 42").scalar(), 42)
+
+    def test_in_memory(self):
+        gateway = DatabaseGateway("sqlite://")
+        gateway.execute("CREATE TABLE spam (id INTEGER)")
+        query = gateway.execute_async("SELECT * FROM spam")
+        self.assertEqual(list(query.iter_rows()), [])
+
+    def test_connection(self):
+        gateway = DatabaseGateway(self.url)
+        with closing(gateway.engine.connect()) as conn:
+            transaction = conn.begin()
+            query = gateway.execute_async(
+                "INSERT INTO spam VALUES (1, 'x')", connection=conn)
+            query.join()
+            query = gateway.execute_async(
+                "SELECT count(*) FROM spam", connection=conn)
+            self.assertEqual(list(query.iter_rows()), [(1,)])
+            query.join()
+            self.assertFalse(conn.closed)
+            transaction.rollback()
+        count = gateway.execute("SELECT count(*) FROM spam").scalar()
+        self.assertEqual(count, 0)
+
+
+class BackgroundLoadingTest(GatewayTestCase):
+    def test_background(self):
+        gateway = DatabaseGateway(self.url, background=True)
+        self.assertTrue(gateway.wait_for_schema(5))
+        self.assertFalse(gateway.schema_loading)
+        self.assertEqual(sorted(gateway.tables), ["eggs", "spam"])
+        self.assertTrue(gateway.tables.is_loaded("eggs"))
+
+    def test_query_while_loading(self):
+        gateway = DatabaseGateway(self.url, background=True)
+        result = gateway.execute("SELECT 42")
+        self.assertEqual(result.scalar(), 42)
+        gateway.wait_for_schema(5)
+
+    def test_error(self):
+        path = os.path.join(self.directory, "missing", "test.db")
+        gateway = DatabaseGateway("sqlite:///" + path, background=True)
+        self.assertTrue(gateway.wait_for_schema(5))
+        self.assertIsInstance(gateway.schema_error, sqlalchemy.exc.DBAPIError)
+        self.assertEqual(list(gateway.tables), [])
+
+    def test_iterate_while_filling(self):
+        catalog = TableCatalog(["a", "c"], None)
+        names = []
+        for name in catalog:
+            catalog.add(sqlalchemy.Table("b", sqlalchemy.MetaData()))
+            names.append(name)
+        self.assertEqual(names, ["a", "c"])
+        self.assertEqual(list(catalog), ["a", "b", "c"])
+
+
+class SchemaCacheTest(GatewayTestCase):
+    def setUp(self):
+        super(SchemaCacheTest, self).setUp()
+        self.cache = SchemaCache(os.path.join(self.directory, "cache"))
+
+    def test_fingerprint_changes(self):
+        engine = sqlalchemy.create_engine(self.url)
+        fingerprint = get_schema_fingerprint(engine)
+        self.assertEqual(get_schema_fingerprint(engine), fingerprint)
+        engine.execute("ALTER TABLE spam ADD COLUMN ham TEXT")
+        self.assertNotEqual(get_schema_fingerprint(engine), fingerprint)
+
+    def test_schema_saved(self):
+        gateway = DatabaseGateway(self.url, cache=self.cache)
+        fingerprint = get_schema_fingerprint(gateway.engine)
+        self.assertEqual(
+            self.cache.load(gateway.engine.url, fingerprint),
+            {"spam": ["id", "spam"], "eggs": ["id", "eggs"]})
+
+    def test_schema_loaded_from_cache(self):
+        DatabaseGateway(self.url, cache=self.cache)
+        gateway = DatabaseGateway(self.url, cache=self.cache)
+        self.assertEqual(sorted(gateway.tables), ["eggs", "spam"])
+        columns = gateway.tables["eggs"].columns
+        self.assertEqual([c.name for c in columns], ["id", "eggs"])
+        # Types are not cached
+        self.assertIsInstance(columns["id"].type, sqlalchemy.types.NullType)
+
+    def test_invalidated_on_schema_change(self):
+        gateway = DatabaseGateway(self.url, cache=self.cache)
+        gateway.execute("CREATE TABLE ham (id INTEGER)")
+        gateway = DatabaseGateway(self.url, cache=self.cache)
+        self.assertEqual(sorted(gateway.tables), ["eggs", "ham", "spam"])
+
+    def test_corrupt_cache(self):
+        gateway = DatabaseGateway(self.url, cache=self.cache)
+        for name in os.listdir(self.cache.directory):
+            with open(os.path.join(self.cache.directory, name), "wb") as f:
+                f.write(b"garbage")
+        gateway = DatabaseGateway(self.url, cache=self.cache)
+        self.assertEqual(sorted(gateway.tables), ["eggs", "spam"])
@@ -0,0 +1,85 @@
+# encoding: utf-8
+
+from __future__ import unicode_literals
+
+import datetime
+import decimal
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import sqlalchemy
+
+from eekhoorn.gateway import DatabaseGateway
+from eekhoorn.importer import CsvImportError, get_converter, import_csv
+
+
+class ConverterTest(unittest.TestCase):
+    def test_types(self):
+        self.assertEqual(get_converter(sqlalchemy.Integer())("42"), 42)
+        self.assertEqual(get_converter(sqlalchemy.Numeric())("1.50"),
+                         decimal.Decimal("1.50"))
+        self.assertIs(get_converter(sqlalchemy.Boolean())("t"), True)
+        self.assertEqual(get_converter(sqlalchemy.Date())("2016-02-29"),
+                         datetime.date(2016, 2, 29))
+        self.assertEqual(
+            get_converter(sqlalchemy.DateTime())("2016-02-29T12:30:00"),
+            datetime.datetime(2016, 2, 29, 12, 30))
+        self.assertEqual(get_converter(sqlalchemy.Text())("spam"), "spam")
+        self.assertEqual(get_converter(sqlalchemy.types.NullType())("1"), "1")
+
+    def test_empty(self):
+        self.assertIsNone(get_converter(sqlalchemy.Integer())(""))
+        self.assertEqual(get_converter(sqlalchemy.Text())(""), "")
+
+
+class ImportCsvTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.gateway = DatabaseGateway("sqlite://", batch_size=2)
+        self.gateway.execute(
+            "CREATE TABLE spam (id INTEGER, price REAL, flag BOOLEAN, "
+            "name TEXT)")
+        self.progress = []
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def import_csv(self, content, **kwargs):
+        path = os.path.join(self.directory, "spam.csv")
+        with io.open(path, "w", encoding="utf-8") as f:
+            f.write(content)
+        return import_csv(self.gateway, path, "spam",
+                          progress=self.progress.append, **kwargs)
+
+    def select(self):
+        return [tuple(row) for row in self.gateway.execute(
+            "SELECT id, price, flag, name FROM spam ORDER BY id")]
+
+    def test_import(self):
+        rows = self.import_csv(
+            "name,id,price,flag\nspam,1,1.5,yes\näpfel,2,,\n,3,10,false\n")
+        self.assertEqual(rows, 3)
+        self.assertEqual(self.progress, [2, 3])
+        self.assertEqual(self.select(), [
+            (1, 1.5, 1, "spam"), (2, None, None, "äpfel"), (3, 10, 0, "")])
+
+    def test_batch_size(self):
+        self.import_csv("id\n1\n2\n3\n4\n5\n", batch_size=4)
+        self.assertEqual(self.progress, [4, 5])
+
+    def test_reflects_untyped_tables(self):
+        # Tables loaded from the schema cache don't know their types
+        self.gateway.tables.add(sqlalchemy.Table(
+            "spam", sqlalchemy.MetaData(), sqlalchemy.Column("id"),
+            sqlalchemy.Column("flag")))
+        self.import_csv("id,flag\n7,true\n")
+        self.assertEqual(self.select(), [(7, None, 1, None)])
+
+    def test_rolls_back_on_error(self):
+        self.assertRaises(
+            CsvImportError, self.import_csv, "id\n1\n2\n3\nspam\n")
+        self.assertEqual(self.select(), [])
+        self.assertRaises(CsvImportError, self.import_csv, "eggs\n1\n")
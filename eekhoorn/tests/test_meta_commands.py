@@ -0,0 +1,186 @@
+# encoding: utf-8
+
+from __future__ import unicode_literals
+
+import io
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from eekhoorn.gateway import DatabaseGateway
+from eekhoorn.meta_commands import (
+    CommandError, MetaCommands, is_command, parse_filter)
+from eekhoorn.result_store import ResultView, RowStore
+
+
+class MetaCommandsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.store = RowStore(["id", "name"])
+        for row in [(3, "Spam"), (1, None), (2, "eggs"), (10, "ham")]:
+            self.store.append(row)
+        self.shown = []
+        self.commands = MetaCommands(self.shown.append)
+        self.commands.set_result(self.store)
+
+    def tearDown(self):
+        self.store.close()
+
+    def run_command(self, source):
+        self.commands.run(source)
+        return list(self.shown[-1])
+
+
+class FilterTest(MetaCommandsTestCase):
+    def filter(self, expression):
+        view = ResultView(self.store)
+        return [row[0] for row in self.store
+                if parse_filter(view, expression)(row)]
+
+    def test_numeric(self):
+        self.assertEqual(self.filter("id > 2"), [3, 10])
+        self.assertEqual(self.filter("id=2"), [2])
+        self.assertEqual(self.filter("id != 2"), [3, 1, 10])
+
+    def test_text(self):
+        self.assertEqual(self.filter("name = eggs"), [2])
+        self.assertEqual(self.filter("name = 'Spam'"), [3])
+        self.assertEqual(self.filter("id = '3'"), [3])
+
+    def test_null(self):
+        self.assertEqual(self.filter("name = NULL"), [1])
+        self.assertEqual(self.filter("name != null"), [3, 2, 10])
+        with self.assertRaises(CommandError):
+            self.filter("name < NULL")
+
+    def test_regex(self):
+        self.assertEqual(self.filter("name ~ ^[se]"), [3, 2])
+        with self.assertRaises(CommandError):
+            self.filter("name ~ (")
+
+    def test_search_all_columns(self):
+        self.assertEqual(self.filter("SPAM"), [3])
+        self.assertEqual(self.filter("1"), [1, 10])
+
+
+class CommandsTest(MetaCommandsTestCase):
+    def test_is_command(self):
+        self.assertTrue(is_command("  \\sort id"))
+        self.assertFalse(is_command("SELECT '\\sort'"))
+
+    def test_sort(self):
+        self.assertEqual(self.run_command("\\sort id desc"),
+                         [(10, "ham"), (3, "Spam"), (2, "eggs"), (1, None)])
+        self.assertEqual(self.run_command("\\sort name;")[0], (1, None))
+
+    def test_commands_combine(self):
+        self.run_command("\\filter id < 10")
+        self.run_command("\\cols name")
+        self.assertEqual(self.run_command("\\sort id"),
+                         [(None, ), ("eggs", ), ("Spam", )])
+        self.assertEqual(len(self.run_command("\\reset")), 4)
+
+    def test_cols(self):
+        self.assertEqual(self.run_command("\\cols name, id")[0], ("Spam", 3))
+        self.assertEqual(self.shown[-1].keys, ["name", "id"])
+        self.assertEqual(self.run_command("\\cols")[0], (3, "Spam"))
+
+    def test_errors(self):
+        for source in ["\\unknown", "\\sort unknown", "\\cols id,unknown",
+                       "\\filter"]:
+            with self.assertRaises(CommandError):
+                self.commands.run(source)
+        with self.assertRaises(CommandError):
+            MetaCommands(self.shown.append).run("\\sort id")
+
+
+class ExportTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.gateway = DatabaseGateway("sqlite://", batch_size=2)
+        self.gateway.execute("CREATE TABLE spam (id INTEGER, name TEXT)")
+        self.gateway.execute(
+            "INSERT INTO spam VALUES (1, 'spam'), (2, NULL), (3, 'eggs')")
+        self.output = io.StringIO()
+        self.commands = MetaCommands(lambda view: None, self.gateway,
+                                     self.output)
+        self.store = self.set_result("SELECT * FROM spam ORDER BY id")
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.directory)
+
+    def set_result(self, source, complete=True):
+        "Executes `source` and stores its rows like the console does."
+        with self.gateway.engine.begin() as conn:
+            result = conn.execute(source)
+            store = RowStore(result.keys())
+            for row in store.record(result):
+                if not complete:
+                    break
+            result.close()
+        self.commands.set_result(store, source)
+        self.store = store
+        return store
+
+    def export(self, name, format=""):
+        path = os.path.join(self.directory, name)
+        self.commands.run("\\export {0} {1}".format(path, format))
+        with io.open(path, encoding="utf-8") as f:
+            return f.read()
+
+    def test_format_from_extension(self):
+        self.assertEqual(self.export("spam.csv"),
+                         "id,name\n1,spam\n2,\n3,eggs\n")
+        self.assertEqual(
+            self.export("spam.jsonl").splitlines()[1],
+            '{"id": 2, "name": null}')
+        self.assertIn("Exported 3 rows", self.output.getvalue())
+
+    def test_explicit_format(self):
+        self.assertEqual(self.export("spam.txt", "tsv"),
+                         "id\tname\n1\tspam\n2\t\n3\teggs\n")
+
+    def test_stored_rows_not_queried_again(self):
+        self.commands.run("\\sort id desc")
+        self.commands.run("\\cols name")
+        self.gateway.execute("DELETE FROM spam")
+        self.assertEqual(self.export("spam.csv"), 'name\neggs\n""\nspam\n')
+
+    @unittest.skipIf(sqlite3.sqlite_version_info < (3, 35),
+                     "SQLite doesn't support RETURNING")
+    def test_no_side_effects_repeated(self):
+        self.set_result(
+            "UPDATE spam SET id = id + 10 WHERE id = 1 RETURNING id")
+        self.assertEqual(self.export("spam.csv"), "id\n11\n")
+        self.assertEqual(self.gateway.execute(
+            "SELECT max(id) FROM spam").scalar(), 11)
+
+    def test_incomplete_result(self):
+        self.set_result("SELECT * FROM spam ORDER BY id", complete=False)
+        self.assertEqual(len(self.store), 1)
+        # SELECT queries are executed again to get all rows
+        self.assertEqual(self.export("spam.csv"),
+                         "id,name\n1,spam\n2,\n3,eggs\n")
+        # Other statements might have side effects
+        self.set_result("PRAGMA table_info(spam)", complete=False)
+        self.assertRaises(CommandError, self.export, "eggs.csv")
+
+    def test_incomplete_result_view(self):
+        self.set_result("SELECT * FROM spam ORDER BY id", complete=False)
+        self.commands.run("\\cols name, id")
+        # The projection is applied to the rows of the repeated query
+        self.assertEqual(self.export("spam.csv"),
+                         "name,id\nspam,1\n,2\neggs,3\n")
+        # The sorted or filtered rows would be a different result
+        self.commands.run("\\sort name")
+        self.assertRaises(CommandError, self.export, "sorted.csv")
+        self.commands.run("\\reset")
+        self.commands.run("\\filter id > 1")
+        self.assertRaises(CommandError, self.export, "filtered.csv")
+
+    def test_errors(self):
+        commands = MetaCommands(lambda view: None, self.gateway, self.output)
+        self.assertRaises(CommandError, commands.run, "\\export spam.csv")
+        self.assertRaises(CommandError, self.commands.run, "\\export")
@@ -0,0 +1,144 @@
+# encoding: utf-8
+
+from __future__ import unicode_literals
+
+import io
+import os
+import sys
+import tempfile
+import unittest
+from collections import namedtuple
+
+from eekhoorn.pager import ColumnScroller, Pager, paginate_external
+from eekhoorn.result_store import ResultStore, RowStore
+from eekhoorn.table import DefaultCellRenderer, Table
+
+
+Event = namedtuple("Event", "evt data")
+
+
+class FakeConsole(object):
+    encoding = "utf-8"
+
+    def __init__(self, keys, height=10, width=80):
+        self.events = [Event("key", key) for key in keys]
+        self.height = height
+        self.width = width
+
+    def prepare(self):
+        pass
+
+    def restore(self):
+        pass
+
+    def get_event(self):
+        return self.events.pop(0) if self.events else None
+
+
+class PaginateExternalTest(unittest.TestCase):
+    def setUp(self):
+        self.old_pager = os.environ.get("PAGER")
+
+    def tearDown(self):
+        if self.old_pager is None:
+            del os.environ["PAGER"]
+        else:
+            os.environ["PAGER"] = self.old_pager
+
+    def test_stops_when_pager_quits(self):
+        os.environ["PAGER"] = "true"
+        pulled = []
+        def lines():
+            while True:
+                pulled.append(None)
+                yield "x" * 100
+        paginate_external(lines(), "utf-8")
+        # Only as many lines as fit into the pipe were pulled
+        self.assertLess(len(pulled), 100000)
+
+    def test_all_lines_written(self):
+        (fd, path) = tempfile.mkstemp()
+        os.close(fd)
+        os.environ["PAGER"] = "tee " + path
+        try:
+            with open(os.devnull, "w") as devnull:
+                stdout = os.dup(1)
+                os.dup2(devnull.fileno(), 1)
+                try:
+                    paginate_external(iter(["spam", "eggs ä"]), "utf-8")
+                finally:
+                    os.dup2(stdout, 1)
+                    os.close(stdout)
+            with open(path, "rb") as output:
+                self.assertEqual(output.read(), "spam\neggs ä\n".encode("utf-8"))
+        finally:
+            os.remove(path)
+
+
+def make_scroller(rows, store=None, rows_ready=None):
+    renderer = DefaultCellRenderer("left")
+    def render(first_column, rows, rows_ready):
+        table = Table([(name, renderer) for name in ["a", "bb", "ccc", "d"]],
+                      12, first_column)
+        return (table, table.render_stream(rows, 10, rows_ready))
+    return ColumnScroller(render, rows, rows_ready, store)
+
+
+class ColumnScrollerTest(unittest.TestCase):
+    def test_scroll(self):
+        scroller = make_scroller([["1", "2", "3", "4"]])
+        lines = list(scroller.render(0))
+        self.assertEqual(lines[3], "│ 1 │ 2  │")
+        self.assertTrue(scroller.scrollable)
+        self.assertEqual(scroller.status, "columns 1-2 of 4")
+        self.assertIsNone(scroller.scroll(-1))
+        lines = list(scroller.scroll(1))
+        self.assertEqual(lines[3], "│ 2  │ 3   │")
+        self.assertEqual(scroller.status, "columns 2-3 of 4")
+        lines = list(scroller.scroll(1))
+        self.assertEqual(lines[3], "│ 3   │ 4 │")
+        self.assertIsNone(scroller.scroll(1))
+
+    def test_stored_rows_read_again(self):
+        store = RowStore(["a", "bb", "ccc", "d"])
+        rows = store.record(iter([[str(i)] * 4 for i in range(5)]))
+        scroller = make_scroller(rows, store, lambda: False)
+        lines = scroller.render(0)
+        # The first row is sampled, the second one rendered
+        self.assertEqual(len([next(lines) for _ in range(6)]), 6)
+        self.assertEqual(len(store), 2)
+        lines = list(scroller.scroll(1))
+        self.assertEqual([line[2] for line in lines[3:-1:2]], list("01234"))
+        self.assertEqual(len(store), 5)
+        self.assertTrue(store.complete)
+        store.close()
+
+
+class PagerScrollTest(unittest.TestCase):
+    def run_pager(self, keys):
+        scroller = make_scroller([[str(i)] * 4 for i in range(20)])
+        lines = scroller.render(0)
+        console = FakeConsole(keys)
+        pager = Pager(console, ResultStore(lines, "utf-8",
+                                           scroller.rows_rendered),
+                      scroller=scroller)
+        self.addCleanup(lambda: pager.store.close())
+        stdout = sys.stdout
+        sys.stdout = io.StringIO()
+        try:
+            pager.run()
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+        return (pager, output)
+
+    def test_scroll_keeps_row(self):
+        (pager, output) = self.run_pager(["j"] * 5 + ["l", "q"])
+        self.assertEqual(pager.store.row_of_line(pager.top), 1)
+        self.assertEqual(pager.store.get_line(pager.top), "│ 1  │ 1   │")
+        self.assertIn("columns 1-2 of 4", output)
+        self.assertIn("columns 2-3 of 4", output)
+
+    def test_no_more_columns(self):
+        (pager, output) = self.run_pager(["right", "right", "right", "q"])
+        self.assertEqual(pager.scroller.status, "columns 3-4 of 4")
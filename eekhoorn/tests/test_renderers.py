@@ -0,0 +1,107 @@
+# encoding: utf-8
+
+from __future__ import unicode_literals
+
+import datetime
+import decimal
+import sqlite3
+import unittest
+
+from eekhoorn.renderers import (
+    NULL_CELL, AutoRenderer, BinaryRenderer, BooleanRenderer,
+    NumericRenderer, TemporalRenderer, TextRenderer, get_column_renderer,
+    get_value_renderer)
+
+
+class FakeDBAPI(object):
+    class TypeObject(object):
+        def __init__(self, *codes):
+            self.codes = codes
+
+        def __eq__(self, other):
+            return other in self.codes
+
+    NUMBER = TypeObject(1, 2)
+    STRING = TypeObject(3)
+    DATETIME = TypeObject(4)
+    BINARY = TypeObject(5)
+
+
+class ColumnRendererTest(unittest.TestCase):
+    def test_from_type_code(self):
+        self.assertIsInstance(
+            get_column_renderer(2, FakeDBAPI), NumericRenderer)
+        self.assertIsInstance(get_column_renderer(3, FakeDBAPI), TextRenderer)
+        self.assertIsInstance(
+            get_column_renderer(4, FakeDBAPI), TemporalRenderer)
+        self.assertIsInstance(get_column_renderer(5, FakeDBAPI), BinaryRenderer)
+
+    def test_unknown_type_code(self):
+        self.assertIsInstance(get_column_renderer(42, FakeDBAPI), AutoRenderer)
+        self.assertIsInstance(get_column_renderer(None, FakeDBAPI),
+                              AutoRenderer)
+        # sqlite3 has no type objects
+        self.assertIsInstance(get_column_renderer(1, sqlite3), AutoRenderer)
+
+    def test_from_value(self):
+        self.assertIsInstance(get_value_renderer(True), BooleanRenderer)
+        self.assertIsInstance(get_value_renderer(1), NumericRenderer)
+        self.assertIsInstance(
+            get_value_renderer(decimal.Decimal("1.5")), NumericRenderer)
+        self.assertIsInstance(
+            get_value_renderer(datetime.date.today()), TemporalRenderer)
+        self.assertIsInstance(get_value_renderer(bytearray(b"a")),
+                              BinaryRenderer)
+        self.assertIsInstance(get_value_renderer("spam"), TextRenderer)
+
+    def test_auto_chooses_once(self):
+        renderer = AutoRenderer()
+        self.assertIs(renderer.prepare(None), NULL_CELL)
+        cell = renderer.prepare(42)
+        self.assertIsInstance(cell.renderer, NumericRenderer)
+        self.assertEqual(cell.text, "42")
+        # Later values use the same renderer
+        self.assertIs(renderer.prepare(23).renderer, cell.renderer)
+        self.assertIs(renderer.prepare(None), NULL_CELL)
+
+    def test_mixed_types(self):
+        # SQLite allows values of any type in any column
+        renderer = AutoRenderer()
+        renderer.prepare(42)
+        cell = renderer.prepare("multi\nline")
+        self.assertIsInstance(cell.renderer, TextRenderer)
+        self.assertEqual(cell.renderer.render_text(cell.text, 12),
+                         [" multi line "])
+        self.assertIsInstance(
+            get_column_renderer(2, FakeDBAPI).prepare("spam").renderer,
+            TextRenderer)
+
+
+class RenderTest(unittest.TestCase):
+    def test_numeric(self):
+        cell = NumericRenderer().prepare(42)
+        lines = cell.renderer.render_text(cell.text, 6)
+        self.assertEqual(lines, ["\x1b[32m   42 \x1b[0m"])
+
+    def test_text(self):
+        cell = TextRenderer().prepare("spam\neggs")
+        self.assertEqual(cell.text, "spam eggs")
+        self.assertEqual(cell.renderer.render_text(cell.text, 11),
+                         [" spam eggs "])
+
+    def test_temporal(self):
+        value = datetime.datetime(2015, 3, 14, 9, 26, 53)
+        self.assertEqual(TemporalRenderer().prepare(value).text,
+                         "2015-03-14 09:26:53")
+
+    def test_boolean(self):
+        renderer = BooleanRenderer()
+        self.assertEqual(renderer.prepare(True).text, "true")
+        self.assertEqual(renderer.prepare(False).text, "false")
+        self.assertEqual(renderer.prepare(1).text, "1")
+
+    def test_binary(self):
+        renderer = BinaryRenderer()
+        self.assertEqual(renderer.prepare(bytearray(b"\x00\xffA")).text,
+                         "\\x00ff41")
+        self.assertEqual(renderer.prepare(memoryview(b"A")).text, "\\x41")
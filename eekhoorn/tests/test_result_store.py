@@ -0,0 +1,122 @@
+# encoding: utf-8
+
+from __future__ import unicode_literals
+
+import unittest
+
+from eekhoorn.result_store import ResultStore, ResultView, RowStore
+from eekhoorn.table import DefaultCellRenderer, Table
+
+
+class ResultStoreTest(unittest.TestCase):
+    def test_lines_pulled_on_demand(self):
+        pulled = []
+        def lines():
+            for i in range(10):
+                pulled.append(i)
+                yield "line {0} ä".format(i)
+        store = ResultStore(lines())
+        self.assertEqual(store.get_lines(2, 3),
+                         ["line 2 ä", "line 3 ä", "line 4 ä"])
+        self.assertEqual(pulled, [0, 1, 2, 3, 4])
+        self.assertFalse(store.complete)
+        # Going back doesn't pull anything
+        self.assertEqual(store.get_lines(0, 2), ["line 0 ä", "line 1 ä"])
+        self.assertEqual(len(pulled), 5)
+        store.close()
+
+    def test_end(self):
+        store = ResultStore(["a", "", "c"])
+        self.assertEqual(store.get_lines(1, 10), ["", "c"])
+        self.assertTrue(store.complete)
+        self.assertEqual(store.fill_all(), 3)
+        self.assertEqual(list(store.iter_lines()), ["a", "", "c"])
+        with self.assertRaises(IndexError):
+            store.get_line(3)
+        store.close()
+
+    def test_empty(self):
+        store = ResultStore([])
+        self.assertEqual(store.get_lines(0, 5), [])
+        self.assertEqual(list(store.iter_lines()), [])
+        store.close()
+
+    def test_rows(self):
+        renderer = DefaultCellRenderer("left")
+        table = Table([("spam", renderer)])
+        rows = [["a"], ["b"], ["c"]]
+        store = ResultStore(
+            table.render_stream(rows), rows_rendered=lambda: table.rows_rendered)
+        # Header has 3 lines, then each row is preceded by a separator
+        self.assertEqual(store.line_of_row(0), 3)
+        self.assertEqual(store.line_of_row(2), 7)
+        self.assertEqual(store.get_line(7), "│ c    │")
+        self.assertIsNone(store.line_of_row(3))
+        self.assertIsNone(store.row_of_line(1))
+        self.assertEqual(store.row_of_line(3), 0)
+        self.assertEqual(store.row_of_line(4), 0)
+        self.assertEqual(store.row_of_line(5), 1)
+        store.close()
+
+    def test_iter_lines_without_storing(self):
+        store = ResultStore(["a", "b", "c"])
+        store.fill(1)
+        self.assertEqual(list(store.iter_lines(store=False)), ["a", "b", "c"])
+        self.assertEqual(len(store), 1)
+        store.close()
+
+
+class RowStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.store = RowStore(["id", "name"])
+        rows = [(3, "c"), (1, None), (2, "b ä")]
+        self.assertEqual(list(self.store.record(rows)), rows)
+
+    def tearDown(self):
+        self.store.close()
+
+    def test_rows(self):
+        self.assertTrue(self.store.complete)
+        self.assertEqual(len(self.store), 3)
+        self.assertEqual(self.store[2], (2, "b ä"))
+        self.assertEqual(list(self.store), [(3, "c"), (1, None), (2, "b ä")])
+
+    def test_incomplete(self):
+        store = RowStore(["id"])
+        rows = store.record([(1, ), (2, )])
+        next(rows)
+        self.assertFalse(store.complete)
+        self.assertEqual(list(store), [(1, )])
+        store.close()
+
+    def test_unpicklable(self):
+        store = RowStore(["value"])
+        store.append([lambda: None])
+        self.assertTrue(store[0][0].startswith("<function"))
+        store.close()
+
+    def test_sort(self):
+        view = ResultView(self.store)
+        self.assertEqual(list(view.sorted("id")),
+                         [(1, None), (2, "b ä"), (3, "c")])
+        self.assertEqual(list(view.sorted("name")),
+                         [(1, None), (2, "b ä"), (3, "c")])
+        self.assertEqual(list(view.sorted("name", reverse=True)),
+                         [(3, "c"), (2, "b ä"), (1, None)])
+        with self.assertRaises(KeyError):
+            view.sorted("unknown")
+
+    def test_sort_mixed_types(self):
+        store = RowStore(["value"])
+        for value in [10, "a", 2]:
+            store.append([value])
+        view = ResultView(store).sorted("value")
+        self.assertEqual(list(view), [(10, ), (2, ), ("a", )])
+        store.close()
+
+    def test_filter_and_project(self):
+        view = ResultView(self.store).filtered(lambda row: row[0] > 1)
+        self.assertEqual(len(view), 2)
+        view = view.projected(["name", "id"]).sorted("id")
+        self.assertEqual(view.keys, ["name", "id"])
+        self.assertEqual(list(view), [("b ä", 2), ("c", 3)])
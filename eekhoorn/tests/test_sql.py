@@ -5,7 +5,11 @@ try:
 except ImportError:
     import unittest
 
-from eekhoorn.sql import statement_finished
+from sqlparse.tokens import Token
+
+from eekhoorn.sql import (
+    IncrementalTokenizer, ParseCache, flatten, get_tokens,
+    get_transaction_control, iter_statements, statement_finished)
 
 
 class SqlTest(unittest.TestCase):
@@ -29,3 +33,147 @@ class SqlTest(unittest.TestCase):
     def test_finished_multiline_string(self):
         sql = "SELECT '\n;\n';"
         self.assertTrue(statement_finished(sql))
+
+    def test_finished_followed_by_next_statement(self):
+        sql = "SELECT 1; SELECT 2"
+        self.assertTrue(statement_finished(sql))
+
+    def test_finished_grouped_tokens(self):
+        sql = "SELECT * FROM spam WHERE eggs LIKE '%';"
+        self.assertTrue(statement_finished(sql, get_tokens(sql)))
+
+
+def char_types(tokens):
+    "Returns the token type of each char."
+    return [t.ttype for t in tokens for _ in t.value]
+
+
+class IncrementalTokenizerTest(unittest.TestCase):
+    def assertTokenizedLikeParse(self, tokens, source):
+        expected = char_types(flatten(get_tokens(source)))
+        self.assertEqual(char_types(tokens), expected)
+
+    def test_empty(self):
+        tokens = IncrementalTokenizer().tokenize("")
+        self.assertEqual([(t.ttype, t.value) for t in tokens],
+                         [(Token.Text, "")])
+
+    def test_edits(self):
+        tokenizer = IncrementalTokenizer()
+        sources = [
+            "SELECT *\nFROM spam\nWHERE eggs = 1",
+            "SELECT *\nFROM spam s\nWHERE eggs = 1",
+            "SELECT *\nFROM spam s\nWHERE eggs = 'spam",
+            "SELECT *\nFROM spam s\nWHERE eggs = 'spam'",
+            "SELECT '\n*\nFROM spam s\nWHERE eggs = 'spam'",
+            "SELECT *\nFROM spam s;\nWHERE eggs = 'spam'",
+            "SELECT *\n/* FROM spam s;\nWHERE eggs = 'spam'",
+            "SELECT *\n/* FROM spam s;\n*/WHERE eggs = 'spam'",
+        ]
+        for source in sources:
+            self.assertTokenizedLikeParse(
+                tokenizer.tokenize(source), source)
+
+    def test_keyword_across_lines(self):
+        tokenizer = IncrementalTokenizer()
+        sources = [
+            "SELECT a\nFROM spam\nGROUP\n",
+            "SELECT a\nFROM spam\nGROUP\nBY a",
+            "SELECT a\nFROM spam\nEND \nIF",
+        ]
+        for source in sources:
+            self.assertEqual(
+                [(t.ttype, t.value) for t in tokenizer.tokenize(source)],
+                [(t.ttype, t.value)
+                 for t in IncrementalTokenizer().tokenize(source)])
+
+    def test_second_statement(self):
+        tokenizer = IncrementalTokenizer()
+        tokenizer.tokenize("SELECT 1\nSELECT 2")
+        tokens = tokenizer.tokenize("SELECT 1;\nSELECT 2")
+        self.assertEqual(tokens[-1].ttype, Token.Error.Next)
+        tokens = tokenizer.tokenize("SELECT 1\nSELECT 2")
+        self.assertNotEqual(tokens[-1].ttype, Token.Error.Next)
+
+    def test_reuses_tokens(self):
+        tokenizer = IncrementalTokenizer()
+        lines = ["SELECT a{0}\n".format(i) for i in range(10)]
+        old_tokens = tokenizer.tokenize("".join(lines))
+        lines[5] = "SELECT b5\n"
+        tokens = tokenizer.tokenize("".join(lines))
+        self.assertIs(tokens[0], old_tokens[0])
+        self.assertIs(tokens[-1], old_tokens[-1])
+
+
+class ParseCacheTest(unittest.TestCase):
+    def test_shared_per_revision(self):
+        cache = ParseCache()
+        tokens = cache.get_tokens("SELECT 1")
+        self.assertIs(cache.get_tokens("SELECT 1"), tokens)
+        cache.tokenize("SELECT 1")
+        self.assertEqual(cache.revision, 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_new_revision(self):
+        cache = ParseCache()
+        tokens = cache.get_tokens("SELECT 1")
+        self.assertIsNot(cache.get_tokens("SELECT 12"), tokens)
+        self.assertEqual(cache.revision, 2)
+        self.assertEqual(cache.hit_rate, 0.0)
+
+    def test_statement_finished(self):
+        cache = ParseCache()
+        source = "SELECT 1;"
+        self.assertTrue(
+            statement_finished(source, cache.get_tokens(source)))
+        self.assertTrue(statement_finished(source, cache.tokenize(source)))
+
+
+class IterStatementsTest(unittest.TestCase):
+    def test_split(self):
+        lines = ["SELECT 1; SELECT 'a;\n", "b'\n", "FROM spam;\n", "SELECT 3"]
+        self.assertEqual(list(iter_statements(lines)),
+                         ["SELECT 1;", "SELECT 'a;\nb'\nFROM spam;",
+                          "SELECT 3"])
+
+    def test_empty_statements_skipped(self):
+        lines = ["-- comment\n", ";\n", "SELECT 1;;\n", "  \n", "/* x */\n"]
+        self.assertEqual(list(iter_statements(lines)), ["SELECT 1;"])
+
+    def test_streaming(self):
+        def lines():
+            yield "SELECT 1;\n"
+            raise AssertionError("Should not be read")
+        self.assertEqual(next(iter_statements(lines())), "SELECT 1;")
+
+    def test_block(self):
+        lines = ["CREATE TRIGGER t AFTER INSERT ON spam BEGIN\n",
+                 "  DELETE FROM eggs;\n", "END;\n", "SELECT 1;\n"]
+        self.assertEqual(list(iter_statements(lines)), [
+            "CREATE TRIGGER t AFTER INSERT ON spam BEGIN\n"
+            "  DELETE FROM eggs;\nEND;", "SELECT 1;"])
+
+    def test_split_first(self):
+        tokenizer = IncrementalTokenizer()
+        self.assertIsNone(tokenizer.split_first("SELECT 1"))
+        self.assertIsNone(tokenizer.split_first("SELECT ';"))
+        (tokens, offset) = tokenizer.split_first("SELECT 1; -- x\nSELECT")
+        self.assertEqual(offset, 15)
+        self.assertEqual("".join(t.value for t in tokens), "SELECT 1; -- x\n")
+
+
+class TransactionControlTest(unittest.TestCase):
+    def test_control(self):
+        self.assertEqual(get_transaction_control("BEGIN;"), "begin")
+        self.assertEqual(get_transaction_control("begin immediate"), "begin")
+        self.assertEqual(
+            get_transaction_control("START TRANSACTION READ ONLY"), "begin")
+        self.assertEqual(get_transaction_control("-- done\nCOMMIT;"),
+                         "commit")
+        self.assertEqual(get_transaction_control("ROLLBACK"), "rollback")
+
+    def test_other_statements(self):
+        self.assertIsNone(get_transaction_control("SELECT 1"))
+        self.assertIsNone(get_transaction_control(""))
+        self.assertIsNone(get_transaction_control("ROLLBACK TO SAVEPOINT a"))
+        self.assertIsNone(get_transaction_control("BEGIN x := 1; END;"))
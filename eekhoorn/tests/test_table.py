@@ -4,8 +4,10 @@ from __future__ import unicode_literals
 
 import textwrap
 import unittest
+from itertools import islice
 
-from eekhoorn.table import DefaultCellRenderer, Table
+from eekhoorn.table import ColumnCells, DefaultCellRenderer, Table
+from eekhoorn.timing import Timings
 
 
 class TableTest(unittest.TestCase):
@@ -100,6 +102,180 @@ class MaxWidthtest(unittest.TestCase):
         for line in table.render():
             self.assertEqual(len(line), 25)
 
+    def make_outlier_table(self, max_width):
+        renderer = DefaultCellRenderer("left")
+        table = Table([("spam", renderer), ("eggs", renderer)], max_width)
+        for i in range(9):
+            table.add_row(["x" * 10, "x"])
+        table.add_row(["y" * 34, "x"])
+        return table
+
+    def test_only_shrunk_as_needed(self):
+        lines = list(self.make_outlier_table(40).render())
+        self.assertTrue(all(len(line) == 40 for line in lines))
+        # The long value is wrapped once
+        self.assertEqual(sum("y" in line for line in lines), 2)
+
+    def test_outliers_wrapped(self):
+        lines = list(self.make_outlier_table(30).render())
+        # The long value doesn't keep the other values from fitting
+        self.assertEqual(lines[3], "│ xxxxxxxxxx          │ x    │")
+        lines = list(self.make_outlier_table(21).render())
+        self.assertEqual(lines[3], "│ xxxxxxxxxx │ x    │")
+
+
+class RenderStreamTest(unittest.TestCase):
+    def make_table(self):
+        renderer = DefaultCellRenderer("left")
+        return Table([("spam", renderer), ("eggs", renderer)])
+
+    def test_like_render(self):
+        rows = [["a", "b"], ["long value", "c"]]
+        table = self.make_table()
+        for row in rows:
+            table.add_row(row)
+        expected = list(table.render())
+        self.assertEqual(list(self.make_table().render_stream(rows)),
+                         expected)
+
+    def test_rows_not_kept(self):
+        table = self.make_table()
+        lines = table.render_stream(iter([["a", "b"]] * 10), sample_size=2)
+        self.assertEqual(table.row_data, [])
+        self.assertEqual(len(list(lines)), 3 + 10 * 2)
+
+    def test_widths_from_sample(self):
+        table = self.make_table()
+        rows = [["a", "b"], ["a much longer value", "c"]]
+        lines = list(table.render_stream(rows, sample_size=1))
+        widths = set(len(line) for line in lines)
+        self.assertEqual(widths, set([len("│ spam │ eggs │")]))
+        # The long value got wrapped
+        self.assertEqual(len(lines), 3 + 1 + 1 + 5 + 1)
+
+    def test_lazy(self):
+        def rows():
+            yield ["a", "b"]
+            raise AssertionError("Should not be consumed")
+        lines = self.make_table().render_stream(rows(), sample_size=1)
+        self.assertEqual(len(list(islice(lines, 4))), 4)
+
+    def test_stop_sampling_when_no_rows_ready(self):
+        ready = [True, False]
+        def rows():
+            yield ["a", "b"]
+            yield ["c", "d"]
+            raise AssertionError("Should not be consumed")
+        lines = self.make_table().render_stream(
+            rows(), sample_size=10, rows_ready=lambda: ready.pop(0))
+        self.assertEqual(len(list(islice(lines, 6))), 6)
+
+    def test_timings(self):
+        timings = Timings()
+        renderer = DefaultCellRenderer("left")
+        table = Table([("spam", renderer), ("eggs", renderer)],
+                      timings=timings)
+        list(table.render_stream([["a", "b"]] * 10, sample_size=2))
+        self.assertGreater(timings["widths"], 0)
+        self.assertGreater(timings["render"], 0)
+
+
+class PreparedCellsTest(unittest.TestCase):
+    def test_converted_once(self):
+        conversions = []
+        class Value(object):
+            def __str__(self):
+                conversions.append(self)
+                return "value"
+            __unicode__ = __str__
+        renderer = DefaultCellRenderer("left")
+        table = Table([("spam", renderer)])
+        table.add_row([Value()])
+        lines = list(table.render())
+        self.assertEqual(lines[3], "│ value │")
+        self.assertEqual(len(conversions), 1)
+
+    def test_cell(self):
+        renderer = DefaultCellRenderer("left")
+        cell = renderer.prepare(42)
+        self.assertEqual(cell, ("42", 4, renderer))
+        self.assertEqual(list(renderer.render_text(cell.text, 5)), [" 42  "])
+
+
+class ViewportTest(unittest.TestCase):
+    def make_table(self, first_column, max_width=17):
+        renderer = DefaultCellRenderer("left")
+        return Table([(name, renderer) for name in ["a", "bb", "ccc", "d"]],
+                     max_width, first_column)
+
+    def test_only_visible_columns(self):
+        table = self.make_table(1)
+        table.add_row(["1", "2", "3", "4"])
+        lines = list(table.render())
+        self.assertEqual(table.visible_columns, ["bb", "ccc", "d"])
+        self.assertEqual(lines[1], "│ bb │ ccc │ d │")
+        self.assertEqual(lines[3], "│ 2  │ 3   │ 4 │")
+        self.assertEqual(lines[-1], "└────┴─────┴───┘")
+
+    def test_viewport_full(self):
+        table = self.make_table(0, 16)
+        list(table.render())
+        self.assertEqual(table.visible_columns, ["a", "bb", "ccc"])
+
+    def test_wide_column_shrunk(self):
+        table = self.make_table(0, 6)
+        table.add_row(["too wide", "2", "3", "4"])
+        lines = list(table.render())
+        self.assertEqual(table.visible_columns, ["a"])
+        self.assertEqual(set(len(line) for line in lines), set([6]))
+
+    def test_stream_only_visible_prepared(self):
+        prepared = []
+        class Renderer(DefaultCellRenderer):
+            def prepare(self, value):
+                prepared.append(value)
+                return super(Renderer, self).prepare(value)
+        renderer = Renderer()
+        table = Table([(name, renderer) for name in "abcd"], 9, 0)
+        lines = list(table.render_stream([["1", "2", "3", "4"]] * 3, 1))
+        self.assertEqual(table.visible_columns, ["a", "b"])
+        self.assertEqual(lines[3], "│ 1 │ 2 │")
+        # All cells of the sampled row, then only the visible ones
+        self.assertEqual(len(prepared), 4 + 2 * 2)
+
+
+class ColumnCellsTest(unittest.TestCase):
+    def test_cells(self):
+        left = DefaultCellRenderer("left")
+        right = DefaultCellRenderer("right")
+        cells = ColumnCells()
+        for cell in [left.prepare("spam"), right.prepare(1), left.prepare("")]:
+            cells.append(cell)
+        self.assertEqual(len(cells), 3)
+        self.assertEqual(cells[1], ("1", 3, right))
+        self.assertEqual(cells[2], ("", 2, left))
+        self.assertEqual(cells.renderers, [left, right])
+
+    def test_widths(self):
+        renderer = DefaultCellRenderer("left")
+        cells = ColumnCells()
+        self.assertEqual(cells.max_width(), 0)
+        self.assertEqual(cells.width_percentile(90), 0)
+        for i in range(1, 11):
+            cells.append(renderer.prepare("x" * i))
+        self.assertEqual(cells.max_width(), 12)
+        self.assertEqual(cells.width_percentile(50), 7)
+        self.assertEqual(cells.width_percentile(90), 11)
+        self.assertEqual(cells.width_percentile(100), 12)
+
+    def test_table_widths(self):
+        renderer = DefaultCellRenderer("left")
+        table = Table([("spam", renderer)])
+        self.assertEqual(table.width, 8)
+        table.add_row(["a much longer value"])
+        self.assertEqual(table.width, 23)
+        self.assertEqual(table.width_percentile("spam", 50), 21)
+
 
 class DefaultCellRendererTest(unittest.TestCase):
     def test_render_empty_value(self):
@@ -108,3 +284,23 @@ class DefaultCellRendererTest(unittest.TestCase):
         renderer = DefaultCellRenderer("left")
         lines = list(renderer.render("", width))
         self.assertEqual(lines, expected)
+
+    def test_fits(self):
+        renderer = DefaultCellRenderer("right")
+        self.assertEqual(renderer.render("spam", 6), [" spam "])
+        self.assertEqual(renderer.render("spam", 8), ["   spam "])
+
+    def test_hard_breaks(self):
+        renderer = DefaultCellRenderer("left")
+        self.assertEqual(renderer.render("spam and eggs", 7),
+                         [" spam ↩", " and e↩", " ggs   "])
+
+    def test_wrap_words(self):
+        renderer = DefaultCellRenderer("left", wrap_words=True)
+        self.assertEqual(renderer.render("spam and eggs", 7),
+                         [" spam ↩", " and  ↩", " eggs  "])
+
+    def test_line_breaks_replaced(self):
+        renderer = DefaultCellRenderer("left")
+        self.assertEqual(renderer.prepare("spam\neggs").text, "spam eggs")
+        self.assertEqual(renderer.render("a\tb", 5), [" a b "])
@@ -0,0 +1,34 @@
+# encoding: utf-8
+
+from __future__ import unicode_literals
+
+import unittest
+
+from eekhoorn.timing import Timings
+
+
+class TimingsTest(unittest.TestCase):
+    def test_add(self):
+        timings = Timings()
+        timings.add("render", 0.5)
+        timings.add("render", 0.25)
+        timings.add("fetch", None)
+        timings.add("execute", 1)
+        self.assertEqual(timings["render"], 0.75)
+        self.assertIsNone(timings["fetch"])
+        # Ordered by phase, only measured phases
+        self.assertEqual(list(timings.as_dict().items()),
+                         [("execute", 1), ("render", 0.75)])
+
+    def test_measure(self):
+        timings = Timings()
+        with timings.measure("output"):
+            pass
+        self.assertGreaterEqual(timings["output"], 0)
+
+    def test_format(self):
+        timings = Timings()
+        timings.add("first_row", 0.01)
+        timings.add("widths", 0.002)
+        self.assertEqual(timings.format(),
+                         "first row 0.0100s | widths 0.0020s")
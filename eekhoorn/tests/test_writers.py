@@ -0,0 +1,52 @@
+# encoding: utf-8
+
+from __future__ import unicode_literals
+
+import datetime
+import decimal
+import io
+import json
+import unittest
+
+from eekhoorn.writers import get_writer
+
+
+class WriterTestCase(unittest.TestCase):
+    def write(self, format, results):
+        stream = io.BytesIO()
+        writer = get_writer(format, stream)
+        for (keys, batches) in results:
+            writer.start_result(keys)
+            for rows in batches:
+                writer.write_rows(rows)
+        writer.flush()
+        return stream.getvalue().decode("utf-8")
+
+
+class CsvWriterTest(WriterTestCase):
+    def test_csv(self):
+        output = self.write("csv", [
+            (["id", "name"], [[(1, "spam, eggs")], [(2, None), (3, "ä")]]),
+            (["n"], [[(bytearray(b"\xff"), )]]),
+        ])
+        self.assertEqual(
+            output, 'id,name\n1,"spam, eggs"\n2,\n3,ä\n\nn\nff\n')
+
+    def test_tsv(self):
+        output = self.write("tsv", [(["a", "b"], [[(1, "x y")]])])
+        self.assertEqual(output, "a\tb\n1\tx y\n")
+
+
+class JsonLinesWriterTest(WriterTestCase):
+    def test_jsonl(self):
+        value = datetime.datetime(2015, 3, 14, 9, 26)
+        output = self.write("jsonl", [
+            (["b", "a"], [[(1, None), (decimal.Decimal("1.10"), value)]])])
+        lines = output.splitlines()
+        self.assertEqual(lines[0], '{"b": 1, "a": null}')
+        self.assertEqual(json.loads(lines[1]),
+                         {"b": "1.10", "a": "2015-03-14T09:26:00"})
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            get_writer("xml", io.BytesIO())
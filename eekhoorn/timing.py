@@ -0,0 +1,60 @@
+# encoding: utf-8
+
+"""
+    Timing of the phases of a query, from executing it to writing its
+    result to the terminal.
+"""
+
+from __future__ import unicode_literals
+
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class Timings(object):
+    """Seconds spent in each phase of a query. Most phases interleave,
+    e.g. rows are rendered while more rows are fetched, so the time of
+    a phase is the sum of the time spent in it and the phases don't add
+    up to the total time. The exception is ``first_row``, which is the
+    time from starting the query until the first row was fetched.
+    """
+
+    #: Names of the phases in the order they start
+    PHASES = ("execute", "first_row", "fetch", "widths", "render", "output")
+
+    def __init__(self):
+        self._seconds = OrderedDict((phase, None) for phase in self.PHASES)
+
+    def add(self, phase, seconds):
+        "Adds `seconds` to the time of `phase`. `None` is ignored."
+        if seconds is None:
+            return
+        self._seconds[phase] = (self._seconds[phase] or 0.0) + seconds
+
+    @contextmanager
+    def measure(self, phase):
+        "Adds the time spent in the ``with`` block to `phase`."
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(phase, time.time() - start)
+
+    def __getitem__(self, phase):
+        "Returns the seconds spent in `phase` or `None` if not measured."
+        return self._seconds[phase]
+
+    def as_dict(self):
+        """Returns an ordered dictionary phase => seconds of all measured
+        phases.
+        """
+        return OrderedDict(
+            (phase, seconds) for (phase, seconds) in self._seconds.items()
+            if seconds is not None)
+
+    def format(self):
+        "Returns a line like ``execute 0.0012s | fetch 0.0534s | ...``."
+        return " | ".join(
+            "{0} {1:.4f}s".format(phase.replace("_", " "), seconds)
+            for (phase, seconds) in self.as_dict().items())
@@ -0,0 +1,152 @@
+# encoding: utf-8
+
+"""
+    Writers for machine-readable output of query results. The writers
+    write encoded text to a binary stream, one batch of rows at a time,
+    so that results of any size can be written with constant memory.
+"""
+
+from __future__ import unicode_literals
+
+import binascii
+import csv
+import datetime
+import decimal
+import io
+import json
+from collections import OrderedDict
+
+from six import PY2, text_type
+
+from eekhoorn.renderers import BINARY_TYPES
+
+
+def to_text(value):
+    """Converts a value of a result to text. Binary values are converted
+    to hex digits.
+    """
+    if isinstance(value, BINARY_TYPES):
+        return binascii.hexlify(bytes(bytearray(value))).decode("ascii")
+    elif isinstance(value, datetime.datetime):
+        return value.isoformat(str(" "))
+    return text_type(value)
+
+
+class CsvWriter(object):
+    """Writes results as CSV. NULL is written as empty field. Several
+    results are separated by an empty line, each starts with a header
+    line.
+    """
+
+    delimiter = ","
+
+    def __init__(self, stream, encoding="utf-8"):
+        self.stream = stream
+        self.encoding = encoding
+        self._results = 0
+        self._buffer = io.BytesIO() if PY2 else io.StringIO()
+        self._writer = csv.writer(
+            self._buffer, delimiter=str(self.delimiter),
+            lineterminator=str("\n"))
+
+    def _format(self, value):
+        if value is None:
+            return ""
+        value = to_text(value)
+        if PY2:
+            # The csv module of Python 2 can't handle unicode
+            return value.encode(self.encoding)
+        return value
+
+    def start_result(self, keys):
+        "Starts a new result with the columns `keys`."
+        if self._results:
+            self.stream.write(b"\n")
+        self._results += 1
+        self.write_rows([keys])
+
+    def write_rows(self, rows):
+        "Writes a batch of rows."
+        self._writer.writerows([self._format(v) for v in row] for row in rows)
+        data = self._buffer.getvalue()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        if not PY2:
+            data = data.encode(self.encoding)
+        self.stream.write(data)
+
+    def flush(self):
+        self.stream.flush()
+
+
+class TsvWriter(CsvWriter):
+    "Writes results as tab separated values."
+
+    delimiter = "\t"
+
+
+def _json_default(value):
+    if isinstance(value, decimal.Decimal):
+        # Keep the precision
+        return text_type(value)
+    elif isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    return to_text(value)
+
+
+class JsonLinesWriter(object):
+    """Writes each row as JSON object on its own line (JSON Lines). The
+    keys of the objects are the column names, in the columns' order.
+    """
+
+    def __init__(self, stream, encoding="utf-8"):
+        self.stream = stream
+        self.encoding = encoding
+        self._keys = []
+
+    def start_result(self, keys):
+        "Starts a new result with the columns `keys`."
+        self._keys = list(keys)
+
+    def write_rows(self, rows):
+        "Writes a batch of rows."
+        keys = self._keys
+        lines = [
+            json.dumps(OrderedDict(zip(keys, row)), default=_json_default,
+                       ensure_ascii=False)
+            for row in rows]
+        if lines:
+            lines.append("")
+            self.stream.write("\n".join(lines).encode(self.encoding))
+
+    def flush(self):
+        self.stream.flush()
+
+
+#: Writer classes by format name
+FORMATS = {
+    "csv": CsvWriter,
+    "tsv": TsvWriter,
+    "jsonl": JsonLinesWriter,
+}
+
+
+#: Formats by file extension
+EXTENSIONS = {
+    ".csv": "csv",
+    ".tsv": "tsv",
+    ".jsonl": "jsonl",
+    ".json": "jsonl",
+}
+
+
+def get_writer(format, stream, encoding="utf-8"):
+    """Returns a writer for the output format `format` (see
+    :data:`FORMATS`) that writes to the binary `stream`. Raises
+    `ValueError` for unknown formats.
+    """
+    try:
+        writer_class = FORMATS[format]
+    except KeyError:
+        raise ValueError("Unknown format: {0!r}".format(format))
+    return writer_class(stream, encoding)